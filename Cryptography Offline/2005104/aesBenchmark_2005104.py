@@ -0,0 +1,196 @@
+import aes_2005104 as aes
+import argparse
+import json
+import os
+import platform
+import statistics
+import sys
+import time
+import numpy as np
+from functools import partial
+
+defaultSizes = [16, 1 << 10, 1 << 16, 1 << 20, 1 << 24, 1 << 26]
+# the original BitVector encryption runs at a few dozen bytes per second
+legacyMaxSize = 1 << 8
+
+
+def percentile(samples, fraction):
+    ordered = sorted(samples)
+    rank = max(1, -(-len(ordered) * fraction // 1))
+    return ordered[int(rank) - 1]
+
+
+def measure(function, warmup, trials):
+    for _ in range(warmup):
+        function()
+
+    samples = []
+    for _ in range(trials):
+        start = time.perf_counter_ns()
+        function()
+        samples.append(time.perf_counter_ns() - start)
+    return samples
+
+
+def summarize(name, operation, mode, backend, size, samples):
+    median = statistics.median(samples)
+    return {
+        "name": name,
+        "operation": operation,
+        "mode": mode,
+        "backend": backend,
+        "size": size,
+        "trials": len(samples),
+        "medianNs": median,
+        "p95Ns": percentile(samples, 0.95),
+        "minNs": min(samples),
+        "mbPerSecond": size / (median / 1e9) / 1e6 if size and median else None,
+    }
+
+
+def keyScheduleCases(keyBytes):
+    keyString = keyBytes.decode("latin-1")
+    yield "keySchedule/legacy", "legacy", lambda: aes.generateKeyMatrices(aes.createKeyMatrix(keyString))
+    yield "keySchedule/expandedKey", "table", lambda: aes.ExpandedKey(keyBytes)
+    yield "keySchedule/cached", "table", lambda: aes.expandKey(keyBytes)
+
+
+def payloadCases(expandedKey, data):
+    # every case is (operation, mode, backend, setup); setup builds the case's
+    # inputs and returns the function to time, so a case that is filtered out
+    # never encrypts anything
+    iv = os.urandom(16)
+    nonce = iv[:12]
+    blockData = data[:len(data) - len(data) % 16]
+
+    if len(data) <= legacyMaxSize:
+        def legacySetup():
+            textBlocks = aes.generateStateMatrices(aes.generateTextBlocks(data.decode("latin-1")))
+            return partial(aes.generateCipherTexts, textBlocks, expandedKey.roundKeys, iv.decode("latin-1"))
+        yield "encrypt", "cbc", "legacy", legacySetup
+
+    # CBC encryption chains every block into the next, so it only has the
+    # one-block-at-a-time T-table path and no bitsliced case
+    yield "encrypt", "cbc", "table", lambda: partial(aes.encrypt, expandedKey, data, iv)
+
+    for backend in sorted(aes.blockEncryptionBackends):
+        yield "decrypt", "cbc", backend, lambda b=backend: partial(
+            aes.decrypt, expandedKey, aes.encrypt(expandedKey, data, iv), backend=b)
+        yield "encrypt", "ctr", backend, lambda b=backend: partial(aes.ctrCrypt, expandedKey, iv, data, backend=b)
+        yield "decrypt", "ctr", backend, lambda b=backend: partial(
+            aes.decryptCTR, expandedKey, aes.encryptCTR(expandedKey, data, iv), backend=b)
+        yield "encrypt", "gcm", backend, lambda b=backend: partial(
+            aes.encryptGCM, expandedKey, data, nonce=nonce, backend=b)
+        yield "decrypt", "gcm", backend, lambda b=backend: partial(
+            aes.decryptGCM, expandedKey, aes.encryptGCM(expandedKey, data, nonce=nonce), backend=b)
+        if blockData:
+            yield "encrypt", "ecb", backend, lambda b=backend: partial(
+                aes.generateCipherTextsECB, aes.bytesToStateMatrices(blockData), expandedKey, b)
+            yield "decrypt", "ecb", backend, lambda b=backend: partial(
+                aes.generateDecipherTextECB, aes.bytesToStateMatrices(blockData), expandedKey, b)
+
+
+def runBenchmarks(sizes, warmup, trials, modes=None, backends=None):
+    keyBytes = b"Thats my Kung Fu"
+    expandedKey = aes.expandKey(keyBytes)
+    results = []
+
+    for name, backend, function in keyScheduleCases(keyBytes):
+        if modes and "keySchedule" not in modes or backends and backend not in backends:
+            continue
+        samples = measure(function, warmup, trials)
+        results.append(summarize(name, "keySchedule", "keySchedule", backend, 0, samples))
+        printResult(results[-1])
+
+    for size in sizes:
+        data = os.urandom(size)
+        for operation, mode, backend, setup in payloadCases(expandedKey, data):
+            if modes and mode not in modes or backends and backend not in backends:
+                continue
+            samples = measure(setup(), warmup, trials)
+            name = f"{operation}/{mode}/{backend}/{size}"
+            results.append(summarize(name, operation, mode, backend, size, samples))
+            printResult(results[-1])
+
+    return {
+        "meta": {
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "python": platform.python_version(),
+            "numpy": np.__version__,
+            "machine": platform.machine(),
+            "cpuCount": os.cpu_count(),
+            "warmup": warmup,
+            "trials": trials,
+        },
+        "results": results,
+    }
+
+
+def printResult(result):
+    throughput = result["mbPerSecond"]
+    throughputText = f"{throughput:10.2f} MB/s" if throughput is not None else ""
+    print(f"{result['name']:<36} median {result['medianNs'] / 1e6:12.4f} ms  "
+          f"p95 {result['p95Ns'] / 1e6:12.4f} ms  {throughputText}", flush=True)
+
+
+def compareResults(baseline, current, threshold):
+    baselineByName = {result["name"]: result for result in baseline["results"]}
+    regressions = []
+
+    for result in current["results"]:
+        reference = baselineByName.get(result["name"])
+        if reference is None or not reference["medianNs"]:
+            continue
+        change = result["medianNs"] / reference["medianNs"] - 1
+        status = "REGRESSION" if change > threshold else "ok"
+        print(f"{result['name']:<36} {reference['medianNs'] / 1e6:12.4f} ms -> "
+              f"{result['medianNs'] / 1e6:12.4f} ms  {change:+8.1%}  {status}")
+        if change > threshold:
+            regressions.append(result["name"])
+
+    return regressions
+
+
+def parseArguments(argv=None):
+    parser = argparse.ArgumentParser(description="AES throughput benchmarks")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    runParser = subparsers.add_parser("run")
+    runParser.add_argument("--output", default="aes_benchmark.json")
+    runParser.add_argument("--sizes", type=int, nargs="+", default=defaultSizes, help="payload sizes in bytes")
+    runParser.add_argument("--max-size", type=int, default=None)
+    runParser.add_argument("--warmup", type=int, default=1)
+    runParser.add_argument("--trials", type=int, default=7)
+    runParser.add_argument("--modes", nargs="+", choices=("keySchedule", "cbc", "ctr", "gcm", "ecb"))
+    runParser.add_argument("--backends", nargs="+")
+
+    compareParser = subparsers.add_parser("compare")
+    compareParser.add_argument("baseline")
+    compareParser.add_argument("current")
+    compareParser.add_argument("--threshold", type=float, default=0.10,
+                               help="relative slowdown of the median that counts as a regression")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    arguments = parseArguments(argv)
+
+    if arguments.command == "run":
+        sizes = [size for size in arguments.sizes if arguments.max_size is None or size <= arguments.max_size]
+        report = runBenchmarks(sizes, arguments.warmup, arguments.trials, arguments.modes, arguments.backends)
+        with open(arguments.output, "w") as outputFile:
+            json.dump(report, outputFile, indent=2)
+        print(f"Results written to {arguments.output}")
+        return 0
+
+    with open(arguments.baseline) as baselineFile, open(arguments.current) as currentFile:
+        regressions = compareResults(json.load(baselineFile), json.load(currentFile), arguments.threshold)
+    if regressions:
+        print(f"{len(regressions)} regression(s) above {arguments.threshold:.0%}")
+        return 1
+    print("No regressions")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,5 +1,14 @@
+import argparse
+import getpass
+import hmac
+import mmap
 import numpy as np
+import os
+import struct
 import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from functools import lru_cache
 from BitVector import *
 Sbox = (
     0x63, 0x7C, 0x77, 0x7B, 0xF2, 0x6B, 0x6F, 0xC5, 0x30, 0x01, 0x67, 0x2B, 0xFE, 0xD7, 0xAB, 0x76,
@@ -223,10 +232,11 @@ def addRoundKey(stateMatrix, keyMatrix):
     return newMatrix
 
 
-def generateCipherTexts(stateMatrices,keyMatrices):
+def generateCipherTexts(stateMatrices,keyMatrices,iv=None):
 	cipherTextsMatrices = np.zeros((len(stateMatrices), 4, 4), dtype=np.uint8)
     
-	iv = generateInitializationVector()
+	if iv is None:
+		iv = generateInitializationVector()
 	ivMatrix = generateIVMatrix(iv)
 	previousStateMatrix = ivMatrix
 	for i in range(len(stateMatrices)):
@@ -275,31 +285,1137 @@ def inverseShiftRow(stateMatrix):
     
     
 def generateDecipherText(cipherTextMatrices,keyMatrices,iv):
-    decipheredTextMatrices = np.zeros((len(cipherTextMatrices), 4, 4), dtype=np.uint8)
-    
+    # CBC decryption has no dependency between blocks, so all blocks go
+    # through the batch core at once and are chained afterwards
     ivMatrix = generateIVMatrix(iv)
-    previousCipherMatrix = ivMatrix
-    
-    for i in range(len(cipherTextMatrices)):
-        currentCipherMatrix = cipherTextMatrices[i].copy()
-        
-        
-        stateMatrix = cipherTextMatrices[i].copy()
-        stateMatrix = addRoundKey(stateMatrix, keyMatrices[10])
-        
-        for j in range(9,-1,-1):
-            stateMatrix = inverseShiftRow(stateMatrix)
-            stateMatrix = inverseSubstituteBytes(stateMatrix)
-            stateMatrix = addRoundKey(stateMatrix, keyMatrices[j])
-            if j != 0:
-                stateMatrix = inverseMixColumns(stateMatrix)
-                
-        decipheredTextMatrices[i] = addRoundKey(stateMatrix, previousCipherMatrix)
-        previousCipherMatrix = currentCipherMatrix
-    
-    return decipheredTextMatrices
+    decryptedMatrices = decryptBlocksBatch(cipherTextMatrices, keyMatrices)
+
+    previousCipherMatrices = np.concatenate((ivMatrix[np.newaxis], cipherTextMatrices[:-1]))
+    return decryptedMatrices ^ previousCipherMatrices
+
+
+def xtime(value):
+    value <<= 1
+    if value & 0x100:
+        value ^= 0x11b
+    return value
+
+
+def gfMultiply(x, y):
+    result = 0
+    while y:
+        if y & 1:
+            result ^= x
+        x = xtime(x)
+        y >>= 1
+    return result
+
+
+def rotateWordRight(word, bits):
+    return ((word >> bits) | (word << (32 - bits))) & 0xFFFFFFFF
+
+
+def packColumn(b0, b1, b2, b3):
+    return (b0 << 24) | (b1 << 16) | (b2 << 8) | b3
+
+
+# T-tables fuse SubBytes and MixColumns into one 32-bit lookup per byte,
+# ShiftRows is folded into which state word each lookup reads from
+Te0 = tuple(packColumn(gfMultiply(s, 2), s, s, gfMultiply(s, 3)) for s in Sbox)
+Te1 = tuple(rotateWordRight(t, 8) for t in Te0)
+Te2 = tuple(rotateWordRight(t, 16) for t in Te0)
+Te3 = tuple(rotateWordRight(t, 24) for t in Te0)
+
+Td0 = tuple(packColumn(gfMultiply(s, 14), gfMultiply(s, 9), gfMultiply(s, 13), gfMultiply(s, 11)) for s in InvSbox)
+Td1 = tuple(rotateWordRight(t, 8) for t in Td0)
+Td2 = tuple(rotateWordRight(t, 16) for t in Td0)
+Td3 = tuple(rotateWordRight(t, 24) for t in Td0)
+
+
+blockStruct = struct.Struct(">4I")
+
+
+def stateMatricesToWords(stateMatrices):
+    matrices = np.asarray(stateMatrices, dtype=np.uint32)
+    words = (matrices[:, 0, :] << 24) | (matrices[:, 1, :] << 16) | (matrices[:, 2, :] << 8) | matrices[:, 3, :]
+    return words.reshape(-1).tolist()
+
+
+def wordsToStateMatrices(words):
+    data = np.array(words, dtype=">u4").tobytes()
+    return np.frombuffer(data, dtype=np.uint8).reshape(-1, 4, 4).transpose(0, 2, 1).copy()
+
+
+def generateRoundKeyWords(keyMatrices):
+    if isinstance(keyMatrices, ExpandedKey):
+        return keyMatrices.roundKeyWords
+    return stateMatricesToWords(keyMatrices)
+
+
+def inverseMixColumnWord(word):
+    return (Td0[Sbox[word >> 24]] ^ Td1[Sbox[(word >> 16) & 0xFF]] ^
+            Td2[Sbox[(word >> 8) & 0xFF]] ^ Td3[Sbox[word & 0xFF]])
+
+
+def generateDecryptionRoundKeyWords(keyMatrices):
+    # round keys for the equivalent inverse cipher: reversed order, with
+    # InvMixColumns applied to every round key except the first and last
+    if isinstance(keyMatrices, ExpandedKey):
+        return keyMatrices.decryptionRoundKeyWords
+    roundKeyWords = generateRoundKeyWords(keyMatrices)
+    decryptionWords = []
+    for j in range(10, -1, -1):
+        roundWords = roundKeyWords[4 * j:4 * j + 4]
+        if j != 0 and j != 10:
+            roundWords = [inverseMixColumnWord(w) for w in roundWords]
+        decryptionWords.extend(roundWords)
+    return decryptionWords
+
+
+expandedKeyCacheSize = 256
+
+
+class ExpandedKey:
+    # read-only key schedule; indexing it yields the encryption round key
+    # matrices, so it can be passed anywhere keyMatrices is accepted
+    __slots__ = ("keyBytes", "roundKeys", "roundKeyWords", "decryptionRoundKeyWords", "cache")
+
+    def __init__(self, keyBytes):
+        keyBytes = bytes(keyBytes)
+        if len(keyBytes) != 16:
+            raise ValueError("AES-128 key must be 16 bytes")
+
+        roundKeys = generateKeyMatrices(bytesToStateMatrices(keyBytes)[0])
+        roundKeyWords = tuple(stateMatricesToWords(roundKeys))
+        decryptionRoundKeyWords = tuple(generateDecryptionRoundKeyWords(roundKeys))
+        roundKeys.flags.writeable = False
+
+        setField = object.__setattr__
+        setField(self, "keyBytes", keyBytes)
+        setField(self, "roundKeys", roundKeys)
+        setField(self, "roundKeyWords", roundKeyWords)
+        setField(self, "decryptionRoundKeyWords", decryptionRoundKeyWords)
+        # per-key precomputations of other modes are memoized here
+        setField(self, "cache", {})
+
+    def __setattr__(self, name, value):
+        raise AttributeError("ExpandedKey is immutable")
+
+    def __delattr__(self, name):
+        raise AttributeError("ExpandedKey is immutable")
+
+    def __getitem__(self, index):
+        return self.roundKeys[index]
+
+    def __len__(self):
+        return len(self.roundKeys)
+
+    def __array__(self, dtype=None, copy=None):
+        if dtype is None:
+            return self.roundKeys
+        return self.roundKeys.astype(dtype)
+
+    def __reduce__(self):
+        return (expandKey, (self.keyBytes,))
+
+    def __repr__(self):
+        # the key itself never ends up in logs or tracebacks
+        return "ExpandedKey(<redacted>)"
+
+
+@lru_cache(maxsize=expandedKeyCacheSize)
+def expandKey(keyBytes):
+    return ExpandedKey(keyBytes)
+
+
+def asExpandedKey(keySchedule):
+    if isinstance(keySchedule, ExpandedKey):
+        return keySchedule
+    return expandKey(stateMatricesToBytes(np.asarray(keySchedule)[:1]))
+
+
+def encryptBlockWords(s0, s1, s2, s3, rk):
+    s0 ^= rk[0]
+    s1 ^= rk[1]
+    s2 ^= rk[2]
+    s3 ^= rk[3]
+
+    for k in range(4, 40, 4):
+        t0 = Te0[s0 >> 24] ^ Te1[(s1 >> 16) & 0xFF] ^ Te2[(s2 >> 8) & 0xFF] ^ Te3[s3 & 0xFF] ^ rk[k]
+        t1 = Te0[s1 >> 24] ^ Te1[(s2 >> 16) & 0xFF] ^ Te2[(s3 >> 8) & 0xFF] ^ Te3[s0 & 0xFF] ^ rk[k + 1]
+        t2 = Te0[s2 >> 24] ^ Te1[(s3 >> 16) & 0xFF] ^ Te2[(s0 >> 8) & 0xFF] ^ Te3[s1 & 0xFF] ^ rk[k + 2]
+        t3 = Te0[s3 >> 24] ^ Te1[(s0 >> 16) & 0xFF] ^ Te2[(s1 >> 8) & 0xFF] ^ Te3[s2 & 0xFF] ^ rk[k + 3]
+        s0, s1, s2, s3 = t0, t1, t2, t3
+
+    S = Sbox
+    return (
+        ((S[s0 >> 24] << 24) | (S[(s1 >> 16) & 0xFF] << 16) | (S[(s2 >> 8) & 0xFF] << 8) | S[s3 & 0xFF]) ^ rk[40],
+        ((S[s1 >> 24] << 24) | (S[(s2 >> 16) & 0xFF] << 16) | (S[(s3 >> 8) & 0xFF] << 8) | S[s0 & 0xFF]) ^ rk[41],
+        ((S[s2 >> 24] << 24) | (S[(s3 >> 16) & 0xFF] << 16) | (S[(s0 >> 8) & 0xFF] << 8) | S[s1 & 0xFF]) ^ rk[42],
+        ((S[s3 >> 24] << 24) | (S[(s0 >> 16) & 0xFF] << 16) | (S[(s1 >> 8) & 0xFF] << 8) | S[s2 & 0xFF]) ^ rk[43],
+    )
+
+
+def decryptBlockWords(s0, s1, s2, s3, dk):
+    s0 ^= dk[0]
+    s1 ^= dk[1]
+    s2 ^= dk[2]
+    s3 ^= dk[3]
+
+    for k in range(4, 40, 4):
+        t0 = Td0[s0 >> 24] ^ Td1[(s3 >> 16) & 0xFF] ^ Td2[(s2 >> 8) & 0xFF] ^ Td3[s1 & 0xFF] ^ dk[k]
+        t1 = Td0[s1 >> 24] ^ Td1[(s0 >> 16) & 0xFF] ^ Td2[(s3 >> 8) & 0xFF] ^ Td3[s2 & 0xFF] ^ dk[k + 1]
+        t2 = Td0[s2 >> 24] ^ Td1[(s1 >> 16) & 0xFF] ^ Td2[(s0 >> 8) & 0xFF] ^ Td3[s3 & 0xFF] ^ dk[k + 2]
+        t3 = Td0[s3 >> 24] ^ Td1[(s2 >> 16) & 0xFF] ^ Td2[(s1 >> 8) & 0xFF] ^ Td3[s0 & 0xFF] ^ dk[k + 3]
+        s0, s1, s2, s3 = t0, t1, t2, t3
+
+    S = InvSbox
+    return (
+        ((S[s0 >> 24] << 24) | (S[(s3 >> 16) & 0xFF] << 16) | (S[(s2 >> 8) & 0xFF] << 8) | S[s1 & 0xFF]) ^ dk[40],
+        ((S[s1 >> 24] << 24) | (S[(s0 >> 16) & 0xFF] << 16) | (S[(s3 >> 8) & 0xFF] << 8) | S[s2 & 0xFF]) ^ dk[41],
+        ((S[s2 >> 24] << 24) | (S[(s1 >> 16) & 0xFF] << 16) | (S[(s0 >> 8) & 0xFF] << 8) | S[s3 & 0xFF]) ^ dk[42],
+        ((S[s3 >> 24] << 24) | (S[(s2 >> 16) & 0xFF] << 16) | (S[(s1 >> 8) & 0xFF] << 8) | S[s0 & 0xFF]) ^ dk[43],
+    )
+
+
+def generateCipherTextsTTable(stateMatrices, keyMatrices, iv=None):
+    if iv is None:
+        iv = generateInitializationVector()
+    roundKeyWords = generateRoundKeyWords(keyMatrices)
+    words = stateMatricesToWords(stateMatrices)
+
+    p0, p1, p2, p3 = stateMatricesToWords([generateIVMatrix(iv)])
+    cipherWords = []
+    for i in range(0, len(words), 4):
+        p0, p1, p2, p3 = encryptBlockWords(
+            words[i] ^ p0, words[i + 1] ^ p1, words[i + 2] ^ p2, words[i + 3] ^ p3, roundKeyWords
+        )
+        cipherWords.extend((p0, p1, p2, p3))
+
+    return iv, wordsToStateMatrices(cipherWords)
+
+
+def generateDecipherTextTTable(cipherTextMatrices, keyMatrices, iv):
+    decryptionKeyWords = generateDecryptionRoundKeyWords(keyMatrices)
+    words = stateMatricesToWords(cipherTextMatrices)
+
+    p0, p1, p2, p3 = stateMatricesToWords([generateIVMatrix(iv)])
+    plainWords = []
+    for i in range(0, len(words), 4):
+        c0, c1, c2, c3 = words[i:i + 4]
+        d0, d1, d2, d3 = decryptBlockWords(c0, c1, c2, c3, decryptionKeyWords)
+        plainWords.extend((d0 ^ p0, d1 ^ p1, d2 ^ p2, d3 ^ p3))
+        p0, p1, p2, p3 = c0, c1, c2, c3
+
+    return wordsToStateMatrices(plainWords)
+
+
+SboxArray = np.array(Sbox, dtype=np.uint8)
+InvSboxArray = np.array(InvSbox, dtype=np.uint8)
+
+mul2 = np.array([gfMultiply(x, 2) for x in range(256)], dtype=np.uint8)
+mul3 = np.array([gfMultiply(x, 3) for x in range(256)], dtype=np.uint8)
+mul9 = np.array([gfMultiply(x, 9) for x in range(256)], dtype=np.uint8)
+mul11 = np.array([gfMultiply(x, 11) for x in range(256)], dtype=np.uint8)
+mul13 = np.array([gfMultiply(x, 13) for x in range(256)], dtype=np.uint8)
+mul14 = np.array([gfMultiply(x, 14) for x in range(256)], dtype=np.uint8)
+
+# gather indices so that shifted[:, r, c] = states[:, r, (c + r) % 4]
+shiftRowRows = np.arange(4).reshape(4, 1)
+shiftRowCols = (np.arange(4).reshape(1, 4) + shiftRowRows) % 4
+inverseShiftRowCols = (np.arange(4).reshape(1, 4) - shiftRowRows) % 4
+rotatedRows = [np.roll(np.arange(4), -i) for i in range(4)]
+
+
+def substituteBytesBatch(stateMatrices):
+    return SboxArray[stateMatrices]
+
+
+def inverseSubstituteBytesBatch(stateMatrices):
+    return InvSboxArray[stateMatrices]
+
+
+def shiftRowBatch(stateMatrices):
+    return stateMatrices[:, shiftRowRows, shiftRowCols]
+
+
+def inverseShiftRowBatch(stateMatrices):
+    return stateMatrices[:, shiftRowRows, inverseShiftRowCols]
+
+
+def mixColumnBatch(stateMatrices):
+    s1 = stateMatrices[:, rotatedRows[1], :]
+    s2 = stateMatrices[:, rotatedRows[2], :]
+    s3 = stateMatrices[:, rotatedRows[3], :]
+    return mul2[stateMatrices] ^ mul3[s1] ^ s2 ^ s3
+
+
+def inverseMixColumnsBatch(stateMatrices):
+    s1 = stateMatrices[:, rotatedRows[1], :]
+    s2 = stateMatrices[:, rotatedRows[2], :]
+    s3 = stateMatrices[:, rotatedRows[3], :]
+    return mul14[stateMatrices] ^ mul11[s1] ^ mul13[s2] ^ mul9[s3]
+
+
+def addRoundKeyBatch(stateMatrices, keyMatrix):
+    return stateMatrices ^ keyMatrix
+
+
+def encryptBlocksBatch(stateMatrices, keyMatrices):
+    stateMatrices = addRoundKeyBatch(np.asarray(stateMatrices, dtype=np.uint8), keyMatrices[0])
+    for j in range(1, 11):
+        stateMatrices = substituteBytesBatch(stateMatrices)
+        stateMatrices = shiftRowBatch(stateMatrices)
+        if j != 10:
+            stateMatrices = mixColumnBatch(stateMatrices)
+        stateMatrices = addRoundKeyBatch(stateMatrices, keyMatrices[j])
+    return stateMatrices
+
+
+def decryptBlocksBatch(cipherTextMatrices, keyMatrices):
+    stateMatrices = addRoundKeyBatch(np.asarray(cipherTextMatrices, dtype=np.uint8), keyMatrices[10])
+    for j in range(9, -1, -1):
+        stateMatrices = inverseShiftRowBatch(stateMatrices)
+        stateMatrices = inverseSubstituteBytesBatch(stateMatrices)
+        stateMatrices = addRoundKeyBatch(stateMatrices, keyMatrices[j])
+        if j != 0:
+            stateMatrices = inverseMixColumnsBatch(stateMatrices)
+    return stateMatrices
+
+
+def generateCipherTextsECB(stateMatrices, keyMatrices, backend="table"):
+    return getBlockBackend(backend)(stateMatrices, keyMatrices)
+
+
+def generateDecipherTextECB(cipherTextMatrices, keyMatrices, backend="table"):
+    return getBlockBackend(backend, decryption=True)(cipherTextMatrices, keyMatrices)
+
+
+# Bitsliced backend: bit b of byte position p of 64 consecutive blocks is
+# packed into one uint64 lane, giving planes of shape (8, 16, lanes). Every
+# step is a fixed sequence of whole-array AND/XOR operations, so no memory
+# access depends on key or data.
+lanesPerWord = 64
+fullMask = np.uint64(0xFFFFFFFFFFFFFFFF)
+
+# squaring is linear over GF(2): bit i of x contributes to the bits of x^(2i)
+squareBitSources = [
+    [i for i in range(8) if gfMultiply(1 << i, 1 << i) >> j & 1] for j in range(8)
+]
+
+# byte position p = 4 * col + row within a block
+bitslicedShiftRowPositions = np.array([4 * ((p // 4 + p % 4) % 4) + p % 4 for p in range(16)])
+bitslicedInverseShiftRowPositions = np.array([4 * ((p // 4 - p % 4) % 4) + p % 4 for p in range(16)])
+
+
+def packBitsliced(blockBytes):
+    blockCount = len(blockBytes)
+    paddedCount = -(-blockCount // lanesPerWord) * lanesPerWord
+    padded = np.zeros((paddedCount, 16), dtype=np.uint8)
+    padded[:blockCount] = blockBytes
+
+    bits = np.unpackbits(padded[:, :, np.newaxis], axis=2, bitorder="little")
+    planes = np.packbits(bits.transpose(2, 1, 0), axis=2, bitorder="little")
+    return np.ascontiguousarray(planes).view("<u8")
+
+
+def unpackBitsliced(planes, blockCount):
+    bits = np.unpackbits(np.ascontiguousarray(planes).view(np.uint8), axis=2, bitorder="little")
+    blockBytes = np.packbits(bits.transpose(2, 1, 0), axis=2, bitorder="little")
+    return blockBytes[:blockCount, :, 0]
+
+
+def gfMultiplyBitsliced(x, y):
+    product = [None] * 15
+    for i in range(8):
+        for j in range(8):
+            term = x[i] & y[j]
+            product[i + j] = term if product[i + j] is None else product[i + j] ^ term
+
+    # reduce modulo x^8 + x^4 + x^3 + x + 1
+    for k in range(14, 7, -1):
+        product[k - 4] ^= product[k]
+        product[k - 5] ^= product[k]
+        product[k - 7] ^= product[k]
+        product[k - 8] ^= product[k]
+    return product[:8]
+
+
+def gfSquareBitsliced(x):
+    result = []
+    for sources in squareBitSources:
+        bit = x[sources[0]]
+        for i in sources[1:]:
+            bit = bit ^ x[i]
+        result.append(bit)
+    return result
+
+
+def gfInverseBitsliced(x):
+    # x^254 by the addition chain 2, 3, 6, 12, 15, 30, 60, 120, 240, 252, 254;
+    # it maps 0 to 0 as the S-box requires
+    x2 = gfSquareBitsliced(x)
+    x3 = gfMultiplyBitsliced(x2, x)
+    x12 = gfSquareBitsliced(gfSquareBitsliced(x3))
+    x15 = gfMultiplyBitsliced(x12, x3)
+    x240 = x15
+    for _ in range(4):
+        x240 = gfSquareBitsliced(x240)
+    x252 = gfMultiplyBitsliced(x240, x12)
+    return gfMultiplyBitsliced(x252, x2)
+
+
+def substituteBytesBitsliced(planes):
+    b = gfInverseBitsliced(list(planes))
+    result = np.empty_like(planes)
+    for i in range(8):
+        bit = b[i] ^ b[(i - 1) % 8] ^ b[(i - 2) % 8] ^ b[(i - 3) % 8] ^ b[(i - 4) % 8]
+        result[i] = ~bit if 0x63 >> i & 1 else bit
+    return result
+
+
+def inverseSubstituteBytesBitsliced(planes):
+    b = []
+    for i in range(8):
+        bit = planes[(i - 1) % 8] ^ planes[(i - 3) % 8] ^ planes[(i - 6) % 8]
+        b.append(~bit if 0x05 >> i & 1 else bit)
+    return np.array(gfInverseBitsliced(b))
+
+
+def xtimeBitsliced(planes):
+    result = np.empty_like(planes)
+    result[0] = planes[7]
+    result[1] = planes[0] ^ planes[7]
+    result[2] = planes[1]
+    result[3] = planes[2] ^ planes[7]
+    result[4] = planes[3] ^ planes[7]
+    result[5:] = planes[4:7]
+    return result
+
+
+def mixColumnBitsliced(planes):
+    columns = planes.reshape(8, 4, 4, -1)
+    a1 = columns[:, :, rotatedRows[1]]
+    a2 = columns[:, :, rotatedRows[2]]
+    a3 = columns[:, :, rotatedRows[3]]
+    # 2*a0 ^ 3*a1 ^ a2 ^ a3 == xtime(a0 ^ a1) ^ a1 ^ a2 ^ a3
+    return (xtimeBitsliced(columns ^ a1) ^ a1 ^ a2 ^ a3).reshape(planes.shape)
+
+
+def inverseMixColumnsBitsliced(planes):
+    # InvMixColumns == MixColumns after adding 4*(a0 ^ a2) to rows 0, 2 and
+    # 4*(a1 ^ a3) to rows 1, 3
+    columns = planes.reshape(8, 4, 4, -1)
+    a2 = columns[:, :, rotatedRows[2]]
+    quadrupled = xtimeBitsliced(xtimeBitsliced(columns ^ a2))
+    return mixColumnBitsliced((columns ^ quadrupled).reshape(planes.shape))
+
+
+def generateBitslicedRoundKeys(keySchedule):
+    expandedKey = asExpandedKey(keySchedule)
+    if "bitslicedRoundKeys" not in expandedKey.cache:
+        # every round key bit becomes an all-zeros or all-ones lane mask
+        keyBytes = expandedKey.roundKeys.transpose(0, 2, 1).reshape(11, 16)
+        keyBits = np.unpackbits(keyBytes[:, :, np.newaxis], axis=2, bitorder="little")
+        masks = keyBits.transpose(0, 2, 1).astype(np.uint64) * fullMask
+        masks.flags.writeable = False
+        expandedKey.cache["bitslicedRoundKeys"] = masks[:, :, :, np.newaxis]
+    return expandedKey.cache["bitslicedRoundKeys"]
+
+
+def encryptBlocksBitsliced(stateMatrices, keySchedule):
+    roundKeys = generateBitslicedRoundKeys(keySchedule)
+    blockBytes = np.asarray(stateMatrices, dtype=np.uint8).transpose(0, 2, 1).reshape(-1, 16)
+
+    planes = packBitsliced(blockBytes) ^ roundKeys[0]
+    for j in range(1, 11):
+        planes = substituteBytesBitsliced(planes)
+        planes = planes[:, bitslicedShiftRowPositions]
+        if j != 10:
+            planes = mixColumnBitsliced(planes)
+        planes ^= roundKeys[j]
+
+    return unpackBitsliced(planes, len(blockBytes)).reshape(-1, 4, 4).transpose(0, 2, 1)
+
+
+def decryptBlocksBitsliced(cipherTextMatrices, keySchedule):
+    roundKeys = generateBitslicedRoundKeys(keySchedule)
+    blockBytes = np.asarray(cipherTextMatrices, dtype=np.uint8).transpose(0, 2, 1).reshape(-1, 16)
+
+    planes = packBitsliced(blockBytes) ^ roundKeys[10]
+    for j in range(9, -1, -1):
+        planes = planes[:, bitslicedInverseShiftRowPositions]
+        planes = inverseSubstituteBytesBitsliced(planes)
+        planes ^= roundKeys[j]
+        if j != 0:
+            planes = inverseMixColumnsBitsliced(planes)
+
+    return unpackBitsliced(planes, len(blockBytes)).reshape(-1, 4, 4).transpose(0, 2, 1)
+
+
+blockEncryptionBackends = {
+    "table": encryptBlocksBatch,
+    "bitsliced": encryptBlocksBitsliced,
+}
+
+blockDecryptionBackends = {
+    "table": decryptBlocksBatch,
+    "bitsliced": decryptBlocksBitsliced,
+}
+
+
+def getBlockBackend(backend, decryption=False):
+    backends = blockDecryptionBackends if decryption else blockEncryptionBackends
+    if backend not in backends:
+        raise ValueError(f"Unknown AES backend: {backend}")
+    return backends[backend]
+
+
+def applyPaddingBytes(data, blockSize=16):
+    paddingLength = blockSize - (len(data) % blockSize)
+    return bytes(data) + bytes((paddingLength,)) * paddingLength
+
+
+def removePaddingBytes(paddedData):
+    if len(paddedData) == 0:
+        raise ValueError("Invalid padding length")
+    paddingLength = paddedData[-1]
+
+    if paddingLength == 0 or paddingLength > 16 or paddingLength > len(paddedData):
+        raise ValueError("Invalid padding length")
 
-def main():
+    if paddedData[-paddingLength:] != bytes((paddingLength,)) * paddingLength:
+        raise ValueError("Invalid padding")
+
+    return paddedData[:-paddingLength]
+
+
+def bytesToStateMatrices(data):
+    # AES fills the state column by column, hence the transpose
+    return np.frombuffer(data, dtype=np.uint8).reshape(-1, 4, 4).transpose(0, 2, 1)
+
+
+def stateMatricesToBytes(stateMatrices):
+    return np.ascontiguousarray(np.asarray(stateMatrices, dtype=np.uint8).transpose(0, 2, 1)).tobytes()
+
+
+def generateInitializationVectorBytes():
+    return os.urandom(16)
+
+
+def cbcEncryptInto(roundKeyWords, data, chainBlock, output, offset):
+    # encrypts whole blocks of data into output[offset:] and returns the last
+    # cipher block so the chain can be continued by the next call
+    words = np.frombuffer(data, dtype=">u4").tolist()
+    packInto = blockStruct.pack_into
+    encryptBlock = encryptBlockWords
+
+    p0, p1, p2, p3 = chainBlock
+    for i in range(0, len(words), 4):
+        p0, p1, p2, p3 = encryptBlock(
+            words[i] ^ p0, words[i + 1] ^ p1, words[i + 2] ^ p2, words[i + 3] ^ p3, roundKeyWords
+        )
+        packInto(output, offset, p0, p1, p2, p3)
+        offset += 16
+
+    return p0, p1, p2, p3
+
+
+def cbcDecryptBlocks(keySchedule, chainedData, backend="table"):
+    # chainedData is the previous cipher block (or IV) followed by the blocks
+    # to decrypt; blocks are independent, so they all go through the batch core
+    view = memoryview(chainedData)
+    cipherBytes = np.frombuffer(view, dtype=np.uint8)
+    decryptedMatrices = getBlockBackend(backend, decryption=True)(bytesToStateMatrices(view[16:]), keySchedule)
+
+    output = bytearray(len(view) - 16)
+    plainBytes = np.frombuffer(output, dtype=np.uint8)
+    plainBytes.reshape(-1, 4, 4)[:] = decryptedMatrices.transpose(0, 2, 1)
+    plainBytes ^= cipherBytes[:-16]
+    return output
+
+
+def encrypt(keySchedule, data, iv=None):
+    if iv is None:
+        iv = generateInitializationVectorBytes()
+    if len(iv) != 16:
+        raise ValueError("IV must be 16 bytes")
+
+    padded = applyPaddingBytes(data)
+    output = bytearray(16 + len(padded))
+    output[:16] = iv
+    cbcEncryptInto(generateRoundKeyWords(keySchedule), padded, blockStruct.unpack(iv), output, 16)
+
+    return bytes(output)
+
+
+def decrypt(keySchedule, data, unpad=True, backend="table"):
+    if len(data) < 32 or len(data) % 16 != 0:
+        raise ValueError("Cipher text must be an IV followed by whole 16-byte blocks")
+
+    output = cbcDecryptBlocks(keySchedule, data, backend)
+
+    if unpad:
+        return removePaddingBytes(bytes(output))
+    return bytes(output)
+
+
+class AESEncryptor:
+    def __init__(self, keySchedule, iv=None):
+        if iv is None:
+            iv = generateInitializationVectorBytes()
+        if len(iv) != 16:
+            raise ValueError("IV must be 16 bytes")
+
+        self.roundKeyWords = generateRoundKeyWords(keySchedule)
+        self.iv = bytes(iv)
+        self.chainBlock = blockStruct.unpack(self.iv)
+        self.buffer = bytearray()
+        self.ivSent = False
+        self.finalized = False
+
+    def update(self, chunk):
+        if self.finalized:
+            raise ValueError("Encryptor has already been finalized")
+
+        self.buffer += chunk
+        wholeLength = len(self.buffer) - len(self.buffer) % 16
+        return self.emit(wholeLength)
+
+    def finalize(self):
+        if self.finalized:
+            raise ValueError("Encryptor has already been finalized")
+
+        self.buffer = bytearray(applyPaddingBytes(self.buffer))
+        output = self.emit(len(self.buffer))
+        self.finalized = True
+        return output
+
+    def emit(self, length):
+        header = 0 if self.ivSent else 16
+        output = bytearray(header + length)
+        if not self.ivSent:
+            output[:16] = self.iv
+            self.ivSent = True
+
+        if length:
+            self.chainBlock = cbcEncryptInto(
+                self.roundKeyWords, memoryview(self.buffer)[:length], self.chainBlock, output, header
+            )
+            del self.buffer[:length]
+        return bytes(output)
+
+
+class AESDecryptor:
+    def __init__(self, keySchedule, unpad=True):
+        self.keySchedule = keySchedule
+        self.unpad = unpad
+        # holds the previous cipher block (the IV at first) followed by
+        # input that has not been decrypted yet
+        self.buffer = bytearray()
+        self.finalized = False
+
+    def update(self, chunk):
+        if self.finalized:
+            raise ValueError("Decryptor has already been finalized")
+
+        self.buffer += chunk
+        # the newest whole block is held back because it may carry the padding
+        blockCount = (len(self.buffer) - 16) // 16 - 1
+        if blockCount <= 0:
+            return b""
+
+        length = 16 + 16 * blockCount
+        output = cbcDecryptBlocks(self.keySchedule, memoryview(self.buffer)[:length])
+        del self.buffer[:length - 16]
+        return bytes(output)
+
+    def finalize(self):
+        if self.finalized:
+            raise ValueError("Decryptor has already been finalized")
+        self.finalized = True
+
+        if len(self.buffer) != 32:
+            raise ValueError("Cipher text must be an IV followed by whole 16-byte blocks")
+
+        output = bytes(cbcDecryptBlocks(self.keySchedule, self.buffer))
+        self.buffer = bytearray()
+        if self.unpad:
+            return removePaddingBytes(output)
+        return output
+
+
+def encryptMany(messages, expandedKey, ivs=None, backend="table"):
+    # CBC cannot be parallelized within a message, but block i of every
+    # message can go through one batched round computation together
+    if ivs is None:
+        ivs = [generateInitializationVectorBytes() for _ in messages]
+    if len(ivs) != len(messages) or any(len(iv) != 16 for iv in ivs):
+        raise ValueError("Every message needs a 16-byte IV")
+    if not messages:
+        return []
+
+    encryptBlocks = getBlockBackend(backend)
+    paddedMessages = [applyPaddingBytes(message) for message in messages]
+    blockCounts = np.array([len(padded) // 16 for padded in paddedMessages])
+
+    # longest messages first, so the streams still active at block i are a prefix
+    order = np.argsort(-blockCounts, kind="stable")
+    sortedCounts = blockCounts[order]
+    starts = np.concatenate(([0], np.cumsum(sortedCounts)[:-1]))
+
+    blocks = np.frombuffer(b"".join(paddedMessages[i] for i in order), dtype=np.uint8).reshape(-1, 16)
+    cipherBlocks = np.empty_like(blocks)
+    chainBlocks = np.frombuffer(b"".join(bytes(ivs[i]) for i in order), dtype=np.uint8).reshape(-1, 16).copy()
+
+    for i in range(int(sortedCounts[0])):
+        activeCount = int(np.count_nonzero(sortedCounts > i))
+        indices = starts[:activeCount] + i
+        stateMatrices = bytesToStateMatrices((blocks[indices] ^ chainBlocks[:activeCount]).tobytes())
+        encrypted = np.asarray(encryptBlocks(stateMatrices, expandedKey)).transpose(0, 2, 1).reshape(-1, 16)
+        cipherBlocks[indices] = encrypted
+        chainBlocks[:activeCount] = encrypted
+
+    results = [None] * len(messages)
+    for position, messageIndex in enumerate(order):
+        start = starts[position]
+        results[messageIndex] = bytes(ivs[messageIndex]) + cipherBlocks[start:start + sortedCounts[position]].tobytes()
+    return results
+
+
+ctrBatchBlocks = 1 << 16
+
+
+def generateCounterBlocks(initialCounter, startBlock, count):
+    # counter blocks are the 128-bit big-endian value initialCounter + i
+    base = (int.from_bytes(initialCounter, "big") + startBlock) % (1 << 128)
+    high = np.uint64(base >> 64)
+    low = np.uint64(base & 0xFFFFFFFFFFFFFFFF)
+
+    lows = low + np.arange(count, dtype=np.uint64)
+    highs = high + (lows < low).astype(np.uint64)
+
+    counterBlocks = np.empty((count, 2), dtype=">u8")
+    counterBlocks[:, 0] = highs
+    counterBlocks[:, 1] = lows
+    return bytesToStateMatrices(counterBlocks.tobytes())
+
+
+def generateKeystream(keySchedule, initialCounter, startBlock, count, backend="table"):
+    counterBlocks = generateCounterBlocks(initialCounter, startBlock, count)
+    return stateMatricesToBytes(getBlockBackend(backend)(counterBlocks, keySchedule))
+
+
+def ctrCryptInto(keySchedule, initialCounter, data, output, outputOffset=0, offset=0, backend="table"):
+    # offset is the byte position of data within the whole CTR stream, so any
+    # range can be processed without touching the bytes before it; the result
+    # is written into output starting at outputOffset
+    if len(initialCounter) != 16:
+        raise ValueError("Initial counter must be 16 bytes")
+    if not len(data):
+        return
+
+    dataBytes = np.frombuffer(data, dtype=np.uint8)
+    outputBytes = np.frombuffer(output, dtype=np.uint8, count=len(dataBytes), offset=outputOffset)
+    position = 0
+    while position < len(dataBytes):
+        block, skip = divmod(offset + position, 16)
+        length = min(len(dataBytes) - position, ctrBatchBlocks * 16 - skip)
+        count = (skip + length + 15) // 16
+
+        keystream = generateKeystream(keySchedule, initialCounter, block, count, backend)
+        np.bitwise_xor(dataBytes[position:position + length],
+                       np.frombuffer(keystream, dtype=np.uint8)[skip:skip + length],
+                       out=outputBytes[position:position + length])
+        position += length
+
+
+def ctrCrypt(keySchedule, initialCounter, data, offset=0, backend="table"):
+    output = bytearray(len(data))
+    ctrCryptInto(keySchedule, initialCounter, data, output, 0, offset, backend)
+    return bytes(output)
+
+
+def ctrCryptParallel(keySchedule, initialCounter, data, offset=0, workers=None, chunkSize=1 << 22,
+                     backend="table", output=None, outputOffset=0, executor=None):
+    # chunks are copied out and submitted only as earlier ones finish, so at
+    # most a couple of chunks per worker are in flight; results go straight
+    # into output, which is allocated here when the caller does not pass one
+    chunkSize -= chunkSize % 16
+    if chunkSize <= 0:
+        raise ValueError("Chunk size must be at least one block")
+
+    view = memoryview(data)
+    if output is None:
+        output = bytearray(len(view))
+    if len(view) <= chunkSize:
+        ctrCryptInto(keySchedule, initialCounter, view, output, outputOffset, offset, backend)
+        return output
+
+    if executor is None:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            return ctrCryptParallel(keySchedule, initialCounter, view, offset, workers, chunkSize, backend,
+                                    output, outputOffset, executor)
+
+    window = 2 * (workers or os.cpu_count() or 1)
+    pending = deque()
+    for start in range(0, len(view), chunkSize):
+        if len(pending) == window:
+            writeCtrChunk(output, outputOffset, *pending.popleft())
+        chunk = bytes(view[start:start + chunkSize])
+        pending.append((start, executor.submit(ctrCrypt, keySchedule, initialCounter, chunk, offset + start,
+                                               backend)))
+    while pending:
+        writeCtrChunk(output, outputOffset, *pending.popleft())
+
+    return output
+
+
+def writeCtrChunk(output, outputOffset, start, future):
+    result = future.result()
+    output[outputOffset + start:outputOffset + start + len(result)] = result
+
+
+def encryptCTR(keySchedule, data, initialCounter=None, backend="table"):
+    if initialCounter is None:
+        initialCounter = generateInitializationVectorBytes()
+    return bytes(initialCounter) + ctrCrypt(keySchedule, initialCounter, data, backend=backend)
+
+
+def decryptCTR(keySchedule, data, backend="table"):
+    if len(data) < 16:
+        raise ValueError("Cipher text must start with a 16-byte initial counter")
+    return ctrCrypt(keySchedule, bytes(data[:16]), memoryview(data)[16:], backend=backend)
+
+
+ghashReduction = 0xE1 << 120
+
+
+def generateGhashTables(keySchedule):
+    # 8-bit tables: ghashTables[j][b] = (byte b at position j) * H, so one
+    # GF(2^128) multiplication by H is 16 lookups instead of 128 shift steps
+    expandedKey = asExpandedKey(keySchedule)
+    if "ghashTables" not in expandedKey.cache:
+        zeroBlock = bytesToStateMatrices(bytes(16))
+        hashKey = int.from_bytes(stateMatricesToBytes(encryptBlocksBatch(zeroBlock, expandedKey)), "big")
+
+        # multiples[i] = H * x^i in the bit-reflected GCM representation
+        multiples = [hashKey]
+        for _ in range(127):
+            value = multiples[-1]
+            multiples.append((value >> 1) ^ ghashReduction if value & 1 else value >> 1)
+
+        tables = []
+        for j in range(16):
+            table = [0] * 256
+            for k in range(8):
+                table[1 << k] = multiples[8 * j + 7 - k]
+            for b in range(1, 256):
+                table[b] = table[b & -b] ^ table[b & (b - 1)]
+            tables.append(tuple(table))
+        expandedKey.cache["ghashTables"] = tuple(tables)
+    return expandedKey.cache["ghashTables"]
+
+
+def ghashUpdate(ghashTables, hashState, data):
+    # absorbs data (zero-padded to a whole block) into the running GHASH value
+    remainder = len(data) % 16
+    if remainder:
+        data = bytes(data) + bytes(16 - remainder)
+    words = np.frombuffer(data, dtype=">u8").tolist()
+
+    T0, T1, T2, T3, T4, T5, T6, T7, T8, T9, T10, T11, T12, T13, T14, T15 = ghashTables
+    y = hashState
+    for i in range(0, len(words), 2):
+        x = y ^ ((words[i] << 64) | words[i + 1])
+        y = (T0[x >> 120] ^ T1[(x >> 112) & 0xFF] ^ T2[(x >> 104) & 0xFF] ^ T3[(x >> 96) & 0xFF] ^
+             T4[(x >> 88) & 0xFF] ^ T5[(x >> 80) & 0xFF] ^ T6[(x >> 72) & 0xFF] ^ T7[(x >> 64) & 0xFF] ^
+             T8[(x >> 56) & 0xFF] ^ T9[(x >> 48) & 0xFF] ^ T10[(x >> 40) & 0xFF] ^ T11[(x >> 32) & 0xFF] ^
+             T12[(x >> 24) & 0xFF] ^ T13[(x >> 16) & 0xFF] ^ T14[(x >> 8) & 0xFF] ^ T15[x & 0xFF])
+    return y
+
+
+def ghashLengths(ghashTables, hashState, aadLength, dataLength):
+    lengthBlock = struct.pack(">QQ", 8 * aadLength, 8 * dataLength)
+    return ghashUpdate(ghashTables, hashState, lengthBlock)
+
+
+def generateGcmPreCounter(ghashTables, nonce):
+    if len(nonce) == 12:
+        return int.from_bytes(bytes(nonce) + b"\x00\x00\x00\x01", "big")
+    hashState = ghashUpdate(ghashTables, 0, nonce)
+    return ghashLengths(ghashTables, hashState, 0, len(nonce))
+
+
+def generateGcmCounterBlocks(preCounter, startBlock, count):
+    # GCM increments only the low 32 bits of the counter block
+    prefix = np.frombuffer((preCounter >> 32).to_bytes(12, "big"), dtype=np.uint8)
+    lows = (np.arange(count, dtype=np.uint64) + np.uint64(((preCounter & 0xFFFFFFFF) + startBlock) & 0xFFFFFFFF))
+    lows &= np.uint64(0xFFFFFFFF)
+
+    counterBlocks = np.empty((count, 16), dtype=np.uint8)
+    counterBlocks[:, :12] = prefix
+    counterBlocks[:, 12:] = lows.astype(">u4").view(np.uint8).reshape(count, 4)
+    return bytesToStateMatrices(counterBlocks.tobytes())
+
+
+def gcmCrypt(keySchedule, nonce, data, aad, decrypting, backend):
+    if len(nonce) == 0:
+        raise ValueError("GCM nonce must not be empty")
+    if len(data) > 16 * ((1 << 32) - 2):
+        raise ValueError("GCM message is too long")
+
+    encryptBlocks = getBlockBackend(backend)
+    ghashTables = generateGhashTables(keySchedule)
+    preCounter = generateGcmPreCounter(ghashTables, nonce)
+    hashState = ghashUpdate(ghashTables, 0, aad)
+
+    # one pass over the data: each chunk is run through CTR and absorbed into
+    # GHASH while it is still hot
+    output = bytearray(data)
+    outputBytes = np.frombuffer(output, dtype=np.uint8)
+    chunkSize = ctrBatchBlocks * 16
+    for start in range(0, len(output), chunkSize):
+        end = min(start + chunkSize, len(output))
+        if decrypting:
+            hashState = ghashUpdate(ghashTables, hashState, memoryview(output)[start:end])
+
+        counterBlocks = generateGcmCounterBlocks(preCounter, 1 + start // 16, (end - start + 15) // 16)
+        keystream = stateMatricesToBytes(encryptBlocks(counterBlocks, keySchedule))
+        outputBytes[start:end] ^= np.frombuffer(keystream, dtype=np.uint8)[:end - start]
+
+        if not decrypting:
+            hashState = ghashUpdate(ghashTables, hashState, memoryview(output)[start:end])
+
+    hashState = ghashLengths(ghashTables, hashState, len(aad), len(data))
+    firstCounterBlock = generateGcmCounterBlocks(preCounter, 0, 1)
+    encryptedPreCounter = int.from_bytes(stateMatricesToBytes(encryptBlocks(firstCounterBlock, keySchedule)), "big")
+    tag = (hashState ^ encryptedPreCounter).to_bytes(16, "big")
+    return bytes(output), tag
+
+
+def gcmEncrypt(keySchedule, nonce, data, aad=b"", tagLength=16, backend="table"):
+    if not 4 <= tagLength <= 16:
+        raise ValueError("GCM tag length must be between 4 and 16 bytes")
+    cipherText, tag = gcmCrypt(keySchedule, nonce, data, aad, False, backend)
+    return cipherText, tag[:tagLength]
+
+
+def gcmDecrypt(keySchedule, nonce, cipherText, tag, aad=b"", backend="table"):
+    if not 4 <= len(tag) <= 16:
+        raise ValueError("GCM tag length must be between 4 and 16 bytes")
+    plainText, expectedTag = gcmCrypt(keySchedule, nonce, cipherText, aad, True, backend)
+    if not hmac.compare_digest(expectedTag[:len(tag)], bytes(tag)):
+        raise ValueError("Authentication tag mismatch")
+    return plainText
+
+
+def encryptGCM(keySchedule, data, aad=b"", nonce=None, backend="table"):
+    if nonce is None:
+        nonce = os.urandom(12)
+    cipherText, tag = gcmEncrypt(keySchedule, nonce, data, aad, backend=backend)
+    return bytes(nonce) + cipherText + tag
+
+
+def decryptGCM(keySchedule, data, aad=b"", backend="table"):
+    if len(data) < 28:
+        raise ValueError("Cipher text must hold a 12-byte nonce and a 16-byte tag")
+    view = memoryview(data)
+    return gcmDecrypt(keySchedule, view[:12], view[12:-16], view[-16:], aad, backend)
+
+
+fileChunkSize = 1 << 24
+keyEnvironmentVariable = "AES_KEY"
+
+
+def mapOutputFile(outputFile, size):
+    outputFile.truncate(size)
+    if size == 0:
+        return None
+    return mmap.mmap(outputFile.fileno(), size)
+
+
+def mapInputFile(inputFile):
+    size = os.fstat(inputFile.fileno()).st_size
+    if size == 0:
+        return None, 0
+    return mmap.mmap(inputFile.fileno(), 0, access=mmap.ACCESS_READ), size
+
+
+def mapFileRange(openFile, start, length, access):
+    # mmap offsets must be multiples of the allocation granularity, so the
+    # map starts a little early; returns the map and where start falls in it
+    alignedStart = start - start % mmap.ALLOCATIONGRANULARITY
+    return mmap.mmap(openFile.fileno(), start - alignedStart + length, access=access,
+                     offset=alignedStart), start - alignedStart
+
+
+def ctrCryptFileRange(keySchedule, initialCounter, inputPath, inputStart, outputPath, outputStart, length,
+                      offset=0, backend="table"):
+    # maps just this range of both files, so a worker reads and writes the
+    # data itself and nothing but the arguments crosses between processes
+    with open(inputPath, "rb") as inputFile, open(outputPath, "r+b") as outputFile:
+        inputMap, inputSkip = mapFileRange(inputFile, inputStart, length, mmap.ACCESS_READ)
+        try:
+            outputMap, outputSkip = mapFileRange(outputFile, outputStart, length, mmap.ACCESS_WRITE)
+            try:
+                with memoryview(inputMap) as inputView:
+                    ctrCryptInto(keySchedule, initialCounter, inputView[inputSkip:inputSkip + length], outputMap,
+                                 outputSkip, offset, backend)
+            finally:
+                outputMap.close()
+        finally:
+            inputMap.close()
+
+
+def ctrCryptFile(keySchedule, initialCounter, inputPath, inputStart, outputPath, outputStart, length,
+                 workers=None, backend="table"):
+    # the output file must already be at least outputStart + length bytes;
+    # one pool serves the whole file
+    ranges = [(keySchedule, initialCounter, inputPath, inputStart + start, outputPath, outputStart + start,
+               min(fileChunkSize, length - start), start, backend) for start in range(0, length, fileChunkSize)]
+    if workers == 1 or len(ranges) <= 1:
+        for arguments in ranges:
+            ctrCryptFileRange(*arguments)
+        return
+
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        for _ in executor.map(ctrCryptFileRange, *zip(*ranges)):
+            pass
+
+
+def checkDistinctFiles(inputPath, outputPath):
+    # the output is truncated before the input is read, so writing over the
+    # input (or a hard link to it) would silently destroy it
+    try:
+        sameFile = os.path.samefile(inputPath, outputPath)
+    except FileNotFoundError:
+        return
+    if sameFile:
+        raise ValueError("Input and output must be different files")
+
+
+def encryptFile(keySchedule, inputPath, outputPath, mode="ctr", workers=None, backend="table"):
+    with open(inputPath, "rb") as inputFile:
+        inputMap, size = mapInputFile(inputFile)
+        try:
+            checkDistinctFiles(inputPath, outputPath)
+            header = generateInitializationVectorBytes()
+            if mode == "ctr":
+                outputSize = 16 + size
+            else:
+                outputSize = 16 + size - size % 16 + 16
+
+            with open(outputPath, "w+b") as outputFile:
+                outputMap = mapOutputFile(outputFile, outputSize)
+                try:
+                    outputMap[:16] = header
+                    if mode == "ctr":
+                        ctrCryptFile(keySchedule, header, inputPath, 0, outputPath, 16, size, workers, backend)
+                    else:
+                        encryptor = AESEncryptor(keySchedule, header)
+                        position = 0
+                        for start in range(0, size, fileChunkSize):
+                            cipherChunk = encryptor.update(inputMap[start:start + fileChunkSize])
+                            outputMap[position:position + len(cipherChunk)] = cipherChunk
+                            position += len(cipherChunk)
+                        cipherChunk = encryptor.finalize()
+                        outputMap[position:position + len(cipherChunk)] = cipherChunk
+                finally:
+                    outputMap.close()
+        finally:
+            if inputMap is not None:
+                inputMap.close()
+
+    return size
+
+
+def decryptFile(keySchedule, inputPath, outputPath, mode="ctr", workers=None, backend="table"):
+    # the input is checked before the output is opened, so a bad input never
+    # truncates an existing output file
+    with open(inputPath, "rb") as inputFile:
+        inputMap, size = mapInputFile(inputFile)
+        try:
+            if size < 16 or (mode == "cbc" and (size < 32 or size % 16 != 0)):
+                raise ValueError("Input is not a valid " + mode.upper() + " cipher text")
+            checkDistinctFiles(inputPath, outputPath)
+            header = inputMap[:16]
+
+            with open(outputPath, "w+b") as outputFile:
+                outputMap = mapOutputFile(outputFile, size - 16)
+                position = size - 16
+                try:
+                    if mode == "ctr":
+                        ctrCryptFile(keySchedule, header, inputPath, 16, outputPath, 0, size - 16, workers, backend)
+                    else:
+                        decryptor = AESDecryptor(keySchedule)
+                        position = 0
+                        for start in range(0, size, fileChunkSize):
+                            plainChunk = decryptor.update(inputMap[start:start + fileChunkSize])
+                            outputMap[position:position + len(plainChunk)] = plainChunk
+                            position += len(plainChunk)
+                        plainChunk = decryptor.finalize()
+                        outputMap[position:position + len(plainChunk)] = plainChunk
+                        position += len(plainChunk)
+                finally:
+                    if outputMap is not None:
+                        outputMap.close()
+
+                # CBC output is only known to be shorter after the padding is removed
+                outputFile.truncate(position)
+        finally:
+            if inputMap is not None:
+                inputMap.close()
+
+    return size
+
+
+def readKey(keyFile=None):
+    # the key never goes on the command line, where any user can read it in
+    # the process list: a key file, then the environment, then a prompt
+    if keyFile is not None:
+        with open(keyFile) as openFile:
+            return openFile.read().rstrip("\r\n")
+    key = os.environ.get(keyEnvironmentVariable)
+    if key is not None:
+        return key
+    return getpass.getpass("Key: ")
+
+
+def runFileCommand(arguments):
+    keySchedule = generateKeyMatrices(createKeyMatrix(readKey(arguments.key_file)))
+    fileFunction = encryptFile if arguments.command == "encrypt" else decryptFile
+
+    start = time.perf_counter()
+    try:
+        size = fileFunction(keySchedule, arguments.input, arguments.output, arguments.mode, arguments.workers,
+                            arguments.backend)
+    except ValueError as error:
+        raise SystemExit(f"{arguments.command} failed: {error}")
+    elapsed = time.perf_counter() - start
+
+    megabytes = size / 1e6
+    print(f"{arguments.command} ({arguments.mode}): {megabytes:.2f} MB in {elapsed:.3f} seconds "
+          f"({megabytes / elapsed if elapsed > 0 else 0:.2f} MB/s)")
+
+
+def parseArguments(argv=None):
+    parser = argparse.ArgumentParser(description="AES-128 file encryption")
+    subparsers = parser.add_subparsers(dest="command")
+    for command in ("encrypt", "decrypt"):
+        subparser = subparsers.add_parser(command)
+        subparser.add_argument("input")
+        subparser.add_argument("output")
+        subparser.add_argument("--key-file", help="file holding the key text, zero-padded to 16 characters; "
+                                                 f"without it the key comes from ${keyEnvironmentVariable} or a prompt")
+        subparser.add_argument("--mode", choices=("ctr", "cbc"), default="ctr")
+        subparser.add_argument("--workers", type=int, default=1, help="processes used for CTR mode")
+        subparser.add_argument("--backend", choices=sorted(blockEncryptionBackends), default="table",
+                               help="block cipher backend used for CTR mode")
+    return parser.parse_args(argv)
+
+
+def demo():
     initialKey = "Thats my Kung Fu"  # input("Enter your initial key : ")
     PlainText = "Two One Nine Two"  # input("Enter your message : ")
 
@@ -318,15 +1434,11 @@ def main():
     
     
     keyMatrix0 = createKeyMatrix(initialKey)
-    keyScheduleStart = time.time()
     keyMatrices = generateKeyMatrices(keyMatrix0)
-    keyScheduleEnd = time.time()
 
     textBlocks = generateTextBlocks(PlainText)
     stateMatrices= generateStateMatrices(textBlocks)
-    encryptionStart=time.time() 
     iv,cipherTextMatrices = generateCipherTexts(stateMatrices,keyMatrices)
-    encryptionEnd= time.time()
     
 
     print("Ciphered Texts :")
@@ -338,9 +1450,7 @@ def main():
 
     print("Deciphered Texts :")
     print("Before Unpadding:")
-    decryptionStart= time.time()
     decipherTextMatrices = generateDecipherText(cipherTextMatrices,keyMatrices,iv)
-    decryptionEnd= time.time()
     print("In HEX: ",end="")
     printMatricesToHex(decipherTextMatrices)
     print("In ASCII: ",end="",flush=True)
@@ -353,13 +1463,18 @@ def main():
     
 
 
-    print("Execution Time Details: ")
-    print("Key Schedule Time: ", keyScheduleEnd - keyScheduleStart,end=" seconds\n")
-    print("Encryption Time: ", encryptionEnd - encryptionStart,end=" seconds\n")
-    print("Decryption Time: ", decryptionEnd - decryptionStart,end=" seconds\n")
+    print("For timings run: python aesBenchmark_2005104.py run")
     
     
     
 
+def main(argv=None):
+    arguments = parseArguments(argv)
+    if arguments.command is None:
+        demo()
+    else:
+        runFileCommand(arguments)
+
+
 if __name__ == "__main__":
     main()
\ No newline at end of file
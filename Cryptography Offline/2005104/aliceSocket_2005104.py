@@ -1,93 +1,132 @@
 import aes_2005104 as aes
 import ecdh_2005104 as ecdh
+import framing_2005104 as framing
+import session_2005104 as session
+import os
 import socket
 
 host= '127.0.0.1'
 port = 12345
 
-def initECDH(k=128): 
-    P, a, b, G = ecdh.generateEcdhParameters(k)
-    alicePrivate = ecdh.generatePrivateKey(k, P)
+curveName = "P-256"
+ticketPath = os.path.join(ecdh.parameterCacheDirectory, "alice_ticket.json")
+
+def initECDH(curveName=curveName): 
+    P, a, b, G = ecdh.getCurve(curveName)
+    order = ecdh.getCurveOrder(curveName)
+    alicePrivate = ecdh.generatePrivateKey(P.bit_length(), P, order[0] if order else None)
     alicePublic = ecdh.generatePublicKey(alicePrivate, G, a, P)
     return P, a, b, G, alicePublic, alicePrivate
 
-def calculateSharedKey(privateKey, bobPublic, a, p):
-    sharedPoint = ecdh.computeShareKey(privateKey, bobPublic, a, p)
-    sharedSecret = sharedPoint[0]
+def calculateSharedKey(privateKey, bobPublic, a, b, p, uniformLadder=False):
+    # GLV/wNAF needs the fewest multiplications; the x-only ladder is slower
+    # but does the same work for every key bit
+    if uniformLadder:
+        sharedSecret = ecdh.computeSharedX(privateKey, bobPublic, a, p, b)
+    else:
+        sharedPoint = ecdh.computeShareKey(privateKey, bobPublic, a, p)
+        sharedSecret = None if sharedPoint is None else sharedPoint[0]
+    
+    if sharedSecret is None:
+        raise ValueError("Shared secret is the point at infinity")
     return sharedSecret
 
 def keySchedule(sharedKey):
-    keyString = ""
-    for i in range(16):
-        byteVal = (sharedKey >> (8 * i)) & 0xFF
-        keyString += chr(byteVal)
-    
-    keyMatrix = aes.createKeyMatrix(keyString)
-    
-    roundKeys = aes.generateKeyMatrices(keyMatrix)
-    
-    return roundKeys
+    keyBytes = (sharedKey & ((1 << 128) - 1)).to_bytes(16, "little")
+    return aes.expandKey(keyBytes)
 
-def encrypt(message, roundKeys):    
-    textBlocks = aes.generateTextBlocks(message)
-    stateMatrices = aes.generateStateMatrices(textBlocks)
-    
-    iv, cipherTextMatrices = aes.generateCipherTexts(stateMatrices, roundKeys)
-    
-    print("Alice's Cipher Text in ASCII: ", end="")
-    cipherStr = aes.printMatricesToAscii(cipherTextMatrices)
-    cipherText = iv + cipherStr
-    
-    return cipherText
+def encrypt(message, roundKeys):
+    # a complete message frame; everything after the type and length is the
+    # IV followed by the cipher text
+    return framing.encodeMessageFrame(roundKeys, message.encode())
 
 def decrypt(cipherText, roundKeys):
-    iv = cipherText[:16]
-    cipherTextBlocks = cipherText[16:]
-    
-    blocks = []
-    for i in range(0, len(cipherTextBlocks), 16):
-        blocks.append(cipherTextBlocks[i:i+16])
-    
-    cipherMatrices = aes.generateStateMatrices(blocks)
-
-    decipheredMatrices = aes.generateDecipherText(cipherMatrices, roundKeys, iv)
-    
-    decipheredText = aes.printMatricesToAscii(decipheredMatrices)
-    
     try:
-        plainText = aes.removePadding(decipheredText)
+        plainText = framing.decryptMessage(roundKeys, cipherText)
     except ValueError:
-        plainText = decipheredText
+        plainText = framing.decryptMessage(roundKeys, cipherText, unpad=False)
     
-    return plainText
+    return plainText.decode(errors="replace")
 
-def main():
-    print("ALICE (CLIENT)")
-    
-    client = socket.socket(socket.AF_INET, socket.SOCK_STREAM)  
-    client.connect((host, port))
-    
-    print("Connected to BOB (server).")
-    
+def receiveFrame(frameReader, expectedType):
+    frameType, body = frameReader.readFrame()
+    if frameType != expectedType:
+        raise ConnectionError(f"Unexpected frame type {frameType}")
+    return body
+
+def resumeSession(client, frameReader, ticket, masterSecret):
+    # one round trip: our nonce and the ticket out, Bob's nonce back
+    clientNonce = os.urandom(session.nonceSize)
+    framing.sendFrame(client, framing.resumeFrame, clientNonce + ticket)
+    
+    frameType, body = frameReader.readFrame()
+    if frameType == framing.resumeRejectedFrame:
+        return None
+    if frameType != framing.resumeAcceptedFrame:
+        raise ConnectionError(f"Unexpected frame type {frameType}")
+    
+    keyBytes, nextMasterSecret = session.deriveResumedSecrets(masterSecret, clientNonce, body[16:])
+    return aes.expandKey(keyBytes), nextMasterSecret
+
+def runHandshake(client, frameReader):
     P, a, b, G, alicePublic, alicePrivate = initECDH()
     
-    params = f"{P} {a} {b} {G[0]} {G[1]} {alicePublic[0]} {alicePublic[1]}"
+    # Bob looks the curve up by name, so only the identifier and the
+    # compressed public key travel: name length, name, SEC1 point
+    name = curveName.encode()
+    params = bytes((len(name),)) + name + ecdh.encodePoint(alicePublic, P)
     
     print("\nSending ECDH parameters to BOB...")
-    client.sendall(str(len(params)).encode())
-    client.sendall(params.encode())
+    framing.sendFrame(client, framing.handshakeFrame, params)
     
 
-    bobPublicStr = client.recv(1024).decode().split()
-    bobPublic = (int(bobPublicStr[0]), int(bobPublicStr[1]))
+    encodedPublic = receiveFrame(frameReader, framing.publicKeyFrame)[16:]
+    if len(encodedPublic) != 1 + ecdh.coordinateSize(P):
+        raise ValueError("BOB's public key is not a compressed point")
+    bobPublic = ecdh.decodePoint(encodedPublic, a, b, P, allowInfinity=False)
     print("Received BOB's public key: ",{bobPublic})
     
 
-    sharedKey = calculateSharedKey(alicePrivate, bobPublic, a, P)
+    sharedKey = calculateSharedKey(alicePrivate, bobPublic, a, b, P)
     print("Shared secret (x-coordinate): ",sharedKey)
     
     print("Generating AES round keys...")
-    roundKeys = keySchedule(sharedKey)
+    return keySchedule(sharedKey), session.deriveMasterSecret(sharedKey, P)
+
+def main():
+    print("ALICE (CLIENT)")
+    
+    client = socket.socket(socket.AF_INET, socket.SOCK_STREAM)  
+    client.connect((host, port))
+    
+    print("Connected to BOB (server).")
+    
+    frameReader = framing.FrameReader(client)
+    server = f"{host}:{port}"
+    
+    established = None
+    stored = session.loadTicket(ticketPath, server)
+    if stored is not None:
+        print("\nResuming the previous session with its ticket...")
+        established = resumeSession(client, frameReader, *stored)
+        if established is None:
+            print("Ticket rejected by BOB, running the full handshake")
+            session.discardTicket(ticketPath)
+    
+    if established is None:
+        established = runHandshake(client, frameReader)
+    roundKeys, masterSecret = established
+    
+    # Bob follows every handshake with a ticket for the next connection, or
+    # an empty one when he does not issue tickets
+    ticket = framing.decryptMessage(roundKeys, receiveFrame(frameReader, framing.ticketFrame))
+    if not ticket:
+        session.discardTicket(ticketPath)
+    else:
+        try:
+            session.saveTicket(ticketPath, server, ticket, masterSecret)
+        except OSError:
+            pass
     
     print("\nSecure communication established!")
     print("Type 'end' to terminate the conversation.")
@@ -98,16 +137,16 @@ def main():
         
         cipherText = encrypt(message, roundKeys)
         # print("Sending encrypted message: ",len(cipherText)," bytes)")
-        print("Sending encrypted message: ",cipherText)
-        client.sendall(cipherText.encode('latin-1'))
+        print("Sending encrypted message: ",cipherText[framing.headerSize - 16:].hex())
+        client.sendall(cipherText)
         
         
         if message.lower() == 'end':
             break
         
-        receivedCipher = client.recv(4096).decode('latin-1')
+        receivedCipher = receiveFrame(frameReader, framing.messageFrame)
         # print("Received encrypted message: ",len(receivedCipher), " bytes")
-        print("Received encrypted message: ",receivedCipher)
+        print("Received encrypted message: ",receivedCipher.hex())
         
         plainText = decrypt(receivedCipher, roundKeys)
         print("Bob: ",plainText)
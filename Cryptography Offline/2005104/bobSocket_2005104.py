@@ -1,65 +1,96 @@
 import aes_2005104 as aes
 import ecdh_2005104 as ecdh
+import framing_2005104 as framing
+import session_2005104 as session
+import argparse
+import asyncio
+import multiprocessing
+import os
+import signal
 import socket
+from concurrent.futures import ProcessPoolExecutor
 
 host = '127.0.0.1'
 port = 12345
+# most chat frames are small, so every connection starts with a small buffer
+# that only grows for a large message
+frameBufferSize = 1 << 12
 
 def initECDH(P, a, b, G, k=128): 
-    bobPrivate = ecdh.generatePrivateKey(k, P)
+    bobPrivate = ecdh.generatePrivateKey(k, P, ecdh.findCurveOrder(P, a, b))
     bobPublic = ecdh.generatePublicKey(bobPrivate, G, a, P)
     
     return bobPublic, bobPrivate
 
-def calculateSharedKey(privateKey, alicePublic, a, p):
-    sharedPoint = ecdh.computeShareKey(privateKey, alicePublic, a, p)
-    sharedSecret = sharedPoint[0]
+def calculateSharedKey(privateKey, alicePublic, a, b, p, uniformLadder=False):
+    # GLV/wNAF needs the fewest multiplications; the x-only ladder is slower
+    # but does the same work for every key bit
+    if uniformLadder:
+        sharedSecret = ecdh.computeSharedX(privateKey, alicePublic, a, p, b)
+    else:
+        sharedPoint = ecdh.computeShareKey(privateKey, alicePublic, a, p)
+        sharedSecret = None if sharedPoint is None else sharedPoint[0]
     
+    if sharedSecret is None:
+        raise ValueError("Shared secret is the point at infinity")
     return sharedSecret
 
 def keySchedule(sharedKey):
-    keyString = ""
-    for i in range(16):
-        byte_val = (sharedKey >> (8 * i)) & 0xFF
-        keyString += chr(byte_val)
-    
-    keyMatrix = aes.createKeyMatrix(keyString)
-    roundKeys = aes.generateKeyMatrices(keyMatrix)
-    
-    return roundKeys
+    keyBytes = (sharedKey & ((1 << 128) - 1)).to_bytes(16, "little")
+    return aes.expandKey(keyBytes)
 
 def encrypt(message, roundKeys):
-    textBlocks = aes.generateTextBlocks(message)
-    stateMatrices = aes.generateStateMatrices(textBlocks)
-    iv, cipherTextMatrices = aes.generateCipherTexts(stateMatrices, roundKeys)
-
-
-    print("Bob's Cipher Text in ASCII: ", end="")
-    cipherStr = aes.printMatricesToAscii(cipherTextMatrices)
-    cipherText = iv + cipherStr
-    return cipherText
+    # a complete message frame; everything after the type and length is the
+    # IV followed by the cipher text
+    return framing.encodeMessageFrame(roundKeys, message.encode())
 
 def decrypt(cipherText, roundKeys):
-    iv = cipherText[:16]
-    cipherTextBlocks = cipherText[16:]
+    try:
+        plainText = framing.decryptMessage(roundKeys, cipherText)
+    except ValueError:
+        plainText = framing.decryptMessage(roundKeys, cipherText, unpad=False)
     
-    blocks = []
-    for i in range(0, len(cipherTextBlocks), 16):
-        blocks.append(cipherTextBlocks[i:i+16])
+    return plainText.decode(errors="replace")
+
+def checkFrameType(frameType, expectedType):
+    if frameType != expectedType:
+        raise ConnectionError(f"Unexpected frame type {frameType}")
 
-    cipherMatrices = aes.generateStateMatrices(blocks)
-    decipheredMatrices = aes.generateDecipherText(cipherMatrices, roundKeys, iv)
+def parseHandshake(body):
+    # name length, curve name, SEC1 public key
+    params = bytes(body[16:])
+    if not params:
+        raise ValueError("Empty handshake")
+    nameLength = params[0]
+    curveName = params[1:1 + nameLength].decode()
+    P, a, b, G = ecdh.getCurve(curveName)
+    encodedPublic = params[1 + nameLength:]
+    if len(encodedPublic) != 1 + ecdh.coordinateSize(P):
+        raise ValueError("Public key is not a compressed point")
+    alicePublic = ecdh.decodePoint(encodedPublic, a, b, P, allowInfinity=False)
+    return curveName, (P, a, b, G), alicePublic
+
+def acceptResumption(ticketKey, body, redeemedTickets, lifetime=session.ticketLifetime):
+    # (roundKeys, next master secret, server nonce) for a valid ticket that
+    # has not been used before, None when the client has to fall back to a
+    # full handshake
+    params = bytes(body[16:])
+    clientNonce, ticket = params[:session.nonceSize], params[session.nonceSize:]
+    if len(clientNonce) != session.nonceSize:
+        return None
     
-    decipheredText = aes.printMatricesToAscii(decipheredMatrices)
+    masterSecret = session.openTicket(ticketKey, ticket, lifetime)
+    if masterSecret is None or not redeemedTickets.redeem(ticket):
+        return None
     
-    try:
-        plainText = aes.removePadding(decipheredText)
-    except ValueError:
-        plainText = decipheredText
-    
-    return plainText
+    serverNonce = os.urandom(session.nonceSize)
+    keyBytes, nextMasterSecret = session.deriveResumedSecrets(masterSecret, clientNonce, serverNonce)
+    return aes.expandKey(keyBytes), nextMasterSecret, serverNonce
 
-def main():
+def runInteractive(host=host, port=port, uniformLadder=False):
+    # the original one-client demo: Bob types every reply himself. Its ticket
+    # key would die with the process, so it never issues tickets and turns
+    # every resumption down
     print("BOB (SERVER)")
     
     server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
@@ -72,18 +103,51 @@ def main():
     client, addr = server.accept()
     print(f"\nALICE connected from {addr}")
     
-    paramsLength = int(client.recv(1024).decode())
+    frameReader = framing.FrameReader(client)
+    frameType, body = frameReader.readFrame()
+    
+    if frameType == framing.resumeFrame:
+        print("\nALICE's session ticket was rejected, running the full handshake")
+        framing.sendFrame(client, framing.resumeRejectedFrame, b"")
+        frameType, body = frameReader.readFrame()
+    
+    roundKeys, _ = runHandshake(client, frameType, body, uniformLadder)
+    framing.sendMessage(client, roundKeys, b"", framing.ticketFrame)
     
-    paramsStr = client.recv(paramsLength).decode()
-    params = paramsStr.split()
+    print("\nSecure communication established!")
+    print("Type 'end' to terminate the conversation.")
+    
+    while True:
+        frameType, receivedCipher = frameReader.readFrame()
+        checkFrameType(frameType, framing.messageFrame)
+        print(f"Received encrypted message: ",receivedCipher.hex())
+        
+        plainText = decrypt(receivedCipher, roundKeys)
+        print(f"Alice: {plainText}")
+        
+        if plainText.lower() == 'end':
+            break
+        
+        message = input("Bob: ")
+        cipherText = encrypt(message, roundKeys)
+        print("Sending encrypted message: ",cipherText[framing.headerSize - 16:].hex())
+        client.sendall(cipherText) 
+        
+        if message.lower() == 'end':
+            break
     
-    P = int(params[0])
-    a = int(params[1])
-    b = int(params[2])
-    G = (int(params[3]), int(params[4]))
-    alicePublic = (int(params[5]), int(params[6]))
+
+    print("\nClosing connection...")
+    client.close()
+    server.close()
+    print("Connection closed.")
+
+def runHandshake(client, frameType, body, uniformLadder=False):
+    checkFrameType(frameType, framing.handshakeFrame)
+    curveName, (P, a, b, G), alicePublic = parseHandshake(body)
     
     print("\nReceived ECDH parameters from ALICE:")
+    print("Curve = ",curveName)
     # print("P = ",P)
     # print("a = ",a)
     # print("b = ",b)
@@ -95,41 +159,228 @@ def main():
     print(f"Bob's private key = ",bobPrivate)
     print(f"Bob's public key = ",bobPublic)
     
-    bobPublicStr = f"{bobPublic[0]} {bobPublic[1]}"
-    client.sendall(bobPublicStr.encode())
+    framing.sendFrame(client, framing.publicKeyFrame, ecdh.encodePoint(bobPublic, P))
     
-    sharedKey = calculateSharedKey(bobPrivate, alicePublic, a, P)
+    sharedKey = calculateSharedKey(bobPrivate, alicePublic, a, b, P, uniformLadder)
     print("Shared secret (x-coordinate): ",sharedKey)
     
     print("Generating AES round keys...")
-    roundKeys = keySchedule(sharedKey)
+    return keySchedule(sharedKey), session.deriveMasterSecret(sharedKey, P)
+
+def echoReply(message):
+    return message
+
+class ChatServer:
+    # serves many ALICE clients at once: every connection gets its own
+    # handshake, key pair and expanded AES key, and a reader and a writer task
+    def __init__(self, host=host, port=port, replyHandler=echoReply, workers=None,
+                 poolSize=256, queueSize=64, shutdownTimeout=5.0, maxFrameSize=framing.maxPayloadSize,
+                 ticketKey=None, ticketLifetime=session.ticketLifetime, uniformLadder=False,
+                 frameBufferSize=frameBufferSize):
+        self.host = host
+        self.port = port
+        self.replyHandler = replyHandler
+        self.poolSize = poolSize
+        self.queueSize = queueSize
+        self.shutdownTimeout = shutdownTimeout
+        self.maxFrameSize = maxFrameSize
+        self.frameBufferSize = frameBufferSize
+        # tickets stay valid for as long as this key is in use
+        self.ticketKey = ticketKey or session.generateTicketKey()
+        self.ticketLifetime = ticketLifetime
+        self.redeemedTickets = session.RedeemedTickets(ticketLifetime)
+        self.uniformLadder = uniformLadder
+        # shared secrets are CPU-bound, so with workers they leave the event
+        # loop; spawned rather than forked, as the key pair pools run threads
+        self.executor = None
+        if workers:
+            self.executor = ProcessPoolExecutor(workers, mp_context=multiprocessing.get_context("spawn"))
+        self.keypairPools = {}
+        self.sessions = {}
+        self.stopping = None
     
-    print("\nSecure communication established!")
-    print("Type 'end' to terminate the conversation.")
+    def getKeypair(self, curveName, P, a, b, G):
+        if not self.poolSize:
+            bobPublic, bobPrivate = initECDH(P, a, b, G)
+            return bobPrivate, bobPublic
+        
+        if curveName not in self.keypairPools:
+            self.keypairPools[curveName] = ecdh.KeypairPool((P, a, b, G), size=self.poolSize)
+        return self.keypairPools[curveName].get()
     
-    while True:
-        receivedCipher = client.recv(4096).decode('latin-1') 
-        print(f"Received encrypted message: ",receivedCipher)
+    async def calculateSharedKey(self, privateKey, alicePublic, a, b, p):
+        if self.executor is None:
+            return calculateSharedKey(privateKey, alicePublic, a, b, p, self.uniformLadder)
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.executor, calculateSharedKey, privateKey, alicePublic, a, b, p,
+                                          self.uniformLadder)
+    
+    async def handshake(self, connection):
+        frameType, body = await connection.readFrame()
         
-        plainText = decrypt(receivedCipher, roundKeys)
-        print(f"Alice: {plainText}")
+        resumed = None
+        if frameType == framing.resumeFrame:
+            resumed = acceptResumption(self.ticketKey, body, self.redeemedTickets, self.ticketLifetime)
+            if resumed is None:
+                await framing.writeFrame(connection, framing.resumeRejectedFrame, b"")
+                frameType, body = await connection.readFrame()
         
-        if plainText.lower() == 'end':
-            break
+        if resumed is not None:
+            roundKeys, masterSecret, serverNonce = resumed
+            await framing.writeFrame(connection, framing.resumeAcceptedFrame, serverNonce)
+        else:
+            checkFrameType(frameType, framing.handshakeFrame)
+            curveName, (P, a, b, G), alicePublic = parseHandshake(body)
+            
+            bobPrivate, bobPublic = self.getKeypair(curveName, P, a, b, G)
+            await framing.writeFrame(connection, framing.publicKeyFrame, ecdh.encodePoint(bobPublic, P))
+            
+            sharedKey = await self.calculateSharedKey(bobPrivate, alicePublic, a, b, P)
+            roundKeys, masterSecret = keySchedule(sharedKey), session.deriveMasterSecret(sharedKey, P)
         
-        message = input("Bob: ")
-        cipherText = encrypt(message, roundKeys)
-        print("Sending encrypted message: ",cipherText)
-        client.sendall(cipherText.encode('latin-1')) 
+        # every session ends its handshake with a fresh ticket for the next one
+        ticket = session.issueTicket(self.ticketKey, masterSecret)
+        await framing.writeMessage(connection, roundKeys, ticket, framing.ticketFrame)
+        return roundKeys
+    
+    async def readMessages(self, connection, roundKeys, outgoing):
+        while True:
+            try:
+                frameType, receivedCipher = await connection.readFrame()
+            except asyncio.IncompleteReadError as error:
+                if error.partial:
+                    raise
+                break
+            checkFrameType(frameType, framing.messageFrame)
+            
+            plainText = decrypt(receivedCipher, roundKeys)
+            if plainText.lower() == 'end':
+                break
+            
+            reply = self.replyHandler(plainText)
+            if reply is not None:
+                await outgoing.put(reply)
         
-        if message.lower() == 'end':
-            break
+        await outgoing.put(None)
     
+    async def writeMessages(self, connection, roundKeys, outgoing):
+        while True:
+            message = await outgoing.get()
+            if message is None:
+                break
+            await framing.writeMessage(connection, roundKeys, message.encode())
+            if message.lower() == 'end':
+                break
+    
+    def createProtocol(self):
+        return framing.FrameProtocol(self.handleClient, self.frameBufferSize, self.maxFrameSize)
+    
+    async def handleClient(self, connection):
+        task = asyncio.current_task()
+        self.sessions[task] = (connection, None)
+        addr = connection.get_extra_info("peername")
+        
+        try:
+            roundKeys = await self.handshake(connection)
+            outgoing = asyncio.Queue(self.queueSize)
+            self.sessions[task] = (connection, outgoing)
+            
+            readerTask = asyncio.create_task(self.readMessages(connection, roundKeys, outgoing))
+            writerTask = asyncio.create_task(self.writeMessages(connection, roundKeys, outgoing))
+            tasks = (readerTask, writerTask)
+            try:
+                done, _ = await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+                if readerTask in done and readerTask.exception() is None:
+                    # let the writer flush the replies queued before the sentinel
+                    await writerTask
+            finally:
+                for childTask in tasks:
+                    childTask.cancel()
+                results = await asyncio.gather(*tasks, return_exceptions=True)
+            
+            for result in results:
+                if isinstance(result, Exception):
+                    raise result
+        except (ConnectionError, asyncio.IncompleteReadError, ValueError) as error:
+            print(f"Session with {addr} failed: {error}")
+        finally:
+            del self.sessions[task]
+            connection.close()
+            try:
+                await connection.wait_closed()
+            except ConnectionError:
+                pass
+    
+    def stop(self):
+        if self.stopping is not None:
+            self.stopping.set()
+    
+    async def serve(self):
+        self.stopping = asyncio.Event()
+        loop = asyncio.get_running_loop()
+        for signalNumber in (signal.SIGINT, signal.SIGTERM):
+            try:
+                loop.add_signal_handler(signalNumber, self.stop)
+            except (NotImplementedError, RuntimeError):
+                pass
+        
+        server = await loop.create_server(self.createProtocol, self.host, self.port, backlog=1024)
+        print(f"Server started on {self.host}:{self.port}")
+        
+        try:
+            await self.stopping.wait()
+        finally:
+            await self.shutdown(server)
+    
+    async def shutdown(self, server):
+        print("\nShutting down...")
+        server.close()
+        
+        # established sessions are told to end and get a moment to flush
+        for _, outgoing in self.sessions.values():
+            if outgoing is not None:
+                try:
+                    outgoing.put_nowait('end')
+                except asyncio.QueueFull:
+                    pass
+        
+        tasks = list(self.sessions)
+        if tasks:
+            _, pending = await asyncio.wait(tasks, timeout=self.shutdownTimeout)
+            # the rest are dropped: aborting the connection ends their reads
+            for task in pending:
+                connection, _ = self.sessions.get(task, (None, None))
+                if connection is not None:
+                    connection.transport.abort()
+            await asyncio.gather(*pending, return_exceptions=True)
+        await server.wait_closed()
+        
+        for pool in self.keypairPools.values():
+            pool.close()
+        if self.executor is not None:
+            self.executor.shutdown()
+        print("Server closed.")
 
-    print("\nClosing connection...")
-    client.close()
-    server.close()
-    print("Connection closed.")
+def parseArguments(argv=None):
+    parser = argparse.ArgumentParser(description="Secure chat server (BOB)")
+    parser.add_argument("--host", default=host)
+    parser.add_argument("--port", type=int, default=port)
+    parser.add_argument("--interactive", action="store_true", help="serve a single client and type the replies")
+    parser.add_argument("--workers", type=int, default=None, help="processes for shared-secret computation")
+    parser.add_argument("--pool-size", type=int, default=256, help="pre-generated key pairs per curve, 0 to disable")
+    parser.add_argument("--uniform-ladder", action="store_true",
+                        help="compute shared secrets with the x-only ladder, which does the same work for every key bit")
+    return parser.parse_args(argv)
+
+def main(argv=None):
+    arguments = parseArguments(argv)
+    if arguments.interactive:
+        runInteractive(arguments.host, arguments.port, uniformLadder=arguments.uniform_ladder)
+        return
+    
+    server = ChatServer(arguments.host, arguments.port, workers=arguments.workers, poolSize=arguments.pool_size,
+                        uniformLadder=arguments.uniform_ladder)
+    asyncio.run(server.serve())
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
@@ -0,0 +1,236 @@
+import ecdh_2005104 as ecdh
+from aesBenchmark_2005104 import compareResults, measure, percentile
+import argparse
+import json
+import os
+import platform
+import random
+import statistics
+import sys
+import time
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+from itertools import cycle
+
+defaultCurves = ["P-256", "secp256k1", "P-384"]
+operationNames = ("multiplication", "inversion", "double", "add")
+batchSize = 100
+# the original affine double-and-add pays an inversion per step
+legacyMaxTrials = 5
+
+operationCounts = Counter()
+
+
+def countOperation(name):
+    operationCounts[name] += 1
+
+
+class CountingElement(int):
+    # field element that reports every product of two field elements; products
+    # with small integer constants (2 * Y, 3 * X) are not counted
+    def __add__(self, other):
+        return CountingElement(int.__add__(self, other))
+
+    def __radd__(self, other):
+        return CountingElement(int.__radd__(self, other))
+
+    def __sub__(self, other):
+        return CountingElement(int.__sub__(self, other))
+
+    def __rsub__(self, other):
+        return CountingElement(int.__rsub__(self, other))
+
+    def __neg__(self):
+        return CountingElement(int.__neg__(self))
+
+    def __mul__(self, other):
+        if isinstance(other, CountingElement):
+            countOperation("multiplication")
+        return CountingElement(int.__mul__(self, other))
+
+    def __rmul__(self, other):
+        if isinstance(other, CountingElement):
+            countOperation("multiplication")
+        return CountingElement(int.__rmul__(self, other))
+
+    def __pow__(self, exponent, modulus=None):
+        # square-and-multiply, as pow itself does it
+        if exponent > 0:
+            operationCounts["multiplication"] += exponent.bit_length() + bin(exponent).count("1") - 2
+        return CountingElement(int.__pow__(self, exponent, modulus))
+
+    def __mod__(self, other):
+        return CountingElement(int.__mod__(self, other))
+
+    def __rmod__(self, other):
+        return CountingElement(int.__rmod__(self, other))
+
+
+ecdh.fieldBackends["counting"] = ecdh.FieldBackend(
+    "counting", CountingElement, lambda x, p: CountingElement(pow(int(x), -1, int(p))))
+
+
+def countOperations(function):
+    # the first call builds any cached tables, so only the second is counted
+    previousBackend = ecdh.setFieldBackend("counting")
+    function()
+    operationCounts.clear()
+    previousHook = ecdh.setOperationHook(countOperation)
+    try:
+        function()
+    finally:
+        ecdh.setOperationHook(previousHook)
+        ecdh.setFieldBackend(previousBackend)
+    return {name: operationCounts[name] for name in operationNames}
+
+
+def summarize(name, curve, operation, method, backend, samples, operations, perCall=1):
+    samples = [sample / perCall for sample in samples]
+    return {
+        "name": name,
+        "curve": curve,
+        "operation": operation,
+        "method": method,
+        "backend": backend,
+        "trials": len(samples),
+        "medianNs": statistics.median(samples),
+        "p10Ns": percentile(samples, 0.10),
+        "p90Ns": percentile(samples, 0.90),
+        "p99Ns": percentile(samples, 0.99),
+        "minNs": min(samples),
+        "operations": {name: count / perCall for name, count in operations.items()},
+    }
+
+
+def benchmarkCases(curve, scalars, peerPublic):
+    P, a, b, G = curve
+    nextScalar = cycle(scalars).__next__
+
+    yield "publicKey", "fixedBase", 1, lambda: ecdh.generatePublicKey(nextScalar(), G, a, P)
+    yield "publicKey", "batch", batchSize, lambda: ecdh.generateKeypairs(batchSize, curve)
+    yield "sharedSecret", "wnaf", 1, lambda: ecdh.scalarMultiplicationWnaf(
+        nextScalar(), ecdh.liftPoint(peerPublic), ecdh.fieldElement(a), ecdh.fieldElement(P))
+    if ecdh.getGlvParameters(a, b, P) is not None:
+        yield "sharedSecret", "glv", 1, lambda: ecdh.scalarMultiplicationGlv(
+            nextScalar(), ecdh.liftPoint(peerPublic), ecdh.fieldElement(a), ecdh.fieldElement(P))
+    yield "sharedSecret", "ladder", 1, lambda: ecdh.computeSharedX(nextScalar(), peerPublic, a, P, b)
+    yield "sharedSecret", "binary", 1, lambda: ecdh.scalarMultiplicationJacobian(
+        nextScalar(), ecdh.liftPoint(peerPublic), ecdh.fieldElement(a), ecdh.fieldElement(P))
+    yield "sharedSecret", "legacy", 1, lambda: ecdh.scalarMultiplication(
+        nextScalar(), ecdh.liftPoint(peerPublic), ecdh.fieldElement(a), ecdh.fieldElement(P))
+
+
+def benchmarkCurve(curveName, backends, warmup, trials, methods=None, seed=42):
+    # runs in a worker process, so it only takes and returns plain data
+    curve = ecdh.getCurve(curveName)
+    P, a, b, G = curve
+    order = ecdh.getCurveOrder(curveName)
+    order = order[0] if order else P
+
+    generator = random.Random(seed)
+    scalars = [generator.randrange(1, order) for _ in range(max(trials, 1))]
+    peerPublic = ecdh.generatePublicKey(generator.randrange(1, order), G, a, P)
+
+    results = []
+    for operation, method, perCall, function in benchmarkCases(curve, scalars, peerPublic):
+        if methods and method not in methods:
+            continue
+        operations = countOperations(function)
+
+        for backend in backends:
+            previousBackend = ecdh.setFieldBackend(backend)
+            try:
+                caseTrials = min(trials, legacyMaxTrials) if method == "legacy" else trials
+                samples = measure(function, warmup, caseTrials)
+            finally:
+                ecdh.setFieldBackend(previousBackend)
+            name = f"{operation}/{method}/{backend}/{curveName}"
+            results.append(summarize(name, curveName, operation, method, backend, samples, operations, perCall))
+
+    return results
+
+
+def runBenchmarks(curves, backends, warmup, trials, methods=None, workers=None):
+    workers = min(workers or os.cpu_count() or 1, len(curves))
+    arguments = (curves, [backends] * len(curves), [warmup] * len(curves),
+                 [trials] * len(curves), [methods] * len(curves))
+
+    results = []
+    if workers > 1:
+        with ProcessPoolExecutor(workers) as executor:
+            curveResults = executor.map(benchmarkCurve, *arguments)
+            for curveResult in curveResults:
+                results.extend(curveResult)
+    else:
+        for curveResult in map(benchmarkCurve, *arguments):
+            results.extend(curveResult)
+
+    for result in results:
+        printResult(result)
+
+    return {
+        "meta": {
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "python": platform.python_version(),
+            "gmpy2": getattr(ecdh.gmpy2, "version", lambda: None)(),
+            "machine": platform.machine(),
+            "cpuCount": os.cpu_count(),
+            "workers": workers,
+            "warmup": warmup,
+            "trials": trials,
+        },
+        "results": results,
+    }
+
+
+def printResult(result):
+    operations = result["operations"]
+    print(f"{result['name']:<40} median {result['medianNs'] / 1e6:10.4f} ms  "
+          f"p90 {result['p90Ns'] / 1e6:10.4f} ms  "
+          f"M {operations['multiplication']:8.0f}  I {operations['inversion']:5.1f}  "
+          f"D {operations['double']:5.0f}  A {operations['add']:5.0f}", flush=True)
+
+
+def parseArguments(argv=None):
+    parser = argparse.ArgumentParser(description="ECDH scalar multiplication benchmarks")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    runParser = subparsers.add_parser("run")
+    runParser.add_argument("--output", default="ecdh_benchmark.json")
+    runParser.add_argument("--curves", nargs="+", default=defaultCurves, choices=sorted(ecdh.namedCurves))
+    runParser.add_argument("--backends", nargs="+", default=[name for name in ecdh.fieldBackends if name != "counting"])
+    runParser.add_argument("--methods", nargs="+")
+    runParser.add_argument("--warmup", type=int, default=2)
+    runParser.add_argument("--trials", type=int, default=25)
+    runParser.add_argument("--workers", type=int, default=None, help="worker processes, one curve each")
+
+    compareParser = subparsers.add_parser("compare")
+    compareParser.add_argument("baseline")
+    compareParser.add_argument("current")
+    compareParser.add_argument("--threshold", type=float, default=0.10,
+                               help="relative slowdown of the median that counts as a regression")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    arguments = parseArguments(argv)
+
+    if arguments.command == "run":
+        report = runBenchmarks(arguments.curves, arguments.backends, arguments.warmup,
+                               arguments.trials, arguments.methods, arguments.workers)
+        with open(arguments.output, "w") as outputFile:
+            json.dump(report, outputFile, indent=2)
+        print(f"Results written to {arguments.output}")
+        return 0
+
+    with open(arguments.baseline) as baselineFile, open(arguments.current) as currentFile:
+        regressions = compareResults(json.load(baselineFile), json.load(currentFile), arguments.threshold)
+    if regressions:
+        print(f"{len(regressions)} regression(s) above {arguments.threshold:.0%}")
+        return 1
+    print("No regressions")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
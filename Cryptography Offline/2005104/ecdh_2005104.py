@@ -1,6 +1,77 @@
+import hashlib
+import json
+import numpy as np
+import os
 import random
-import sympy
+import secrets
+import threading
 import time
+from collections import OrderedDict, deque
+from concurrent.futures import ProcessPoolExecutor
+from functools import lru_cache
+
+try:
+    import gmpy2
+except ImportError:
+    gmpy2 = None
+
+class FieldBackend:
+    # how field elements are represented (element) and inverted (inverse);
+    # the curve code itself only uses +, -, *, % and pow on them
+    def __init__(self, name, element, inverse):
+        self.name = name
+        self.element = element
+        self.inverse = inverse
+
+def pythonInverse(x, p):
+    # extended Euclid in C, much cheaper than Fermat's pow(x, p - 2, p)
+    return pow(x, -1, p)
+
+fieldBackends = {"python": FieldBackend("python", int, pythonInverse)}
+if gmpy2 is not None:
+    fieldBackends["gmpy2"] = FieldBackend("gmpy2", gmpy2.mpz, gmpy2.invert)
+
+fieldBackend = fieldBackends["gmpy2" if gmpy2 is not None else "python"]
+
+def setFieldBackend(name):
+    global fieldBackend
+    if name not in fieldBackends:
+        raise ValueError(f"Unknown field backend: {name} (available: {', '.join(fieldBackends)})")
+    
+    previous = fieldBackend.name
+    fieldBackend = fieldBackends[name]
+    # cached tables hold elements of the previous backend
+    precomputeOddMultiples.cache_clear()
+    getFixedBaseTable.cache_clear()
+    return previous
+
+# optional callable taking an operation name ("double", "add", "inversion"),
+# used by the benchmarks to count work; None keeps the hot paths bookkeeping-free
+operationHook = None
+
+def setOperationHook(hook):
+    global operationHook
+    previous = operationHook
+    operationHook = hook
+    return previous
+
+def fieldInverse(x, p):
+    if operationHook is not None:
+        operationHook("inversion")
+    return fieldBackend.inverse(x, p)
+
+def fieldElement(x):
+    return fieldBackend.element(x)
+
+def liftPoint(point):
+    if point is None:
+        return None
+    return tuple(fieldBackend.element(coordinate) for coordinate in point)
+
+def lowerPoint(point):
+    if point is None:
+        return None
+    return tuple(int(coordinate) for coordinate in point)
 
 def legendreSymbol(a, p):
     
@@ -13,14 +84,10 @@ def legendreSymbol(a, p):
         return -1
     return ls
 
-def tonelliShanks(n, p):
-    
-    if legendreSymbol(n, p) != 1:
-        return None 
-    
-    if p % 4 == 3:
-        return pow(n, (p + 1) // 4, p)
-    
+@lru_cache(maxsize=64)
+def tonelliShanksConstants(p):
+    # p - 1 = q * 2^s with q odd, a quadratic non-residue z and z^q; these
+    # only depend on p, so they are found once per prime
     q = p - 1
     s = 0
     while q % 2 == 0:
@@ -31,8 +98,19 @@ def tonelliShanks(n, p):
     while legendreSymbol(z, p) != -1:
         z += 1
     
+    return q, s, z, pow(z, q, p)
+
+def tonelliShanks(n, p):
+    
+    if legendreSymbol(n, p) != 1:
+        return None 
+    
+    if p % 4 == 3:
+        return pow(n, (p + 1) // 4, p)
+    
+    q, s, z, c = tonelliShanksConstants(p)
+    
     m = s
-    c = pow(z, q, p)
     t = pow(n, q, p)
     r = pow(n, (q + 1) // 2, p)
 
@@ -67,6 +145,8 @@ def findPointOnCurve(a, b, p):
         
         right_side = (pow(x, 3, p) + (a * x) % p + b) % p
         
+        # tonelliShanks starts with the Euler criterion, so a non-residue
+        # costs a single exponentiation
         y = tonelliShanks(right_side, p)
         
         if y is not None:
@@ -76,6 +156,109 @@ def findPointOnCurve(a, b, p):
     
     raise ValueError(f"Could not find a point on the curve after {max_attempts} attempts")
 
+def findCurveCoefficients(P):
+    while True:
+        a = random.randint(0, P - 1)
+        b = random.randint(0, P - 1)
+        if (4 * pow(a, 3, P) + 27 * pow(b, 2, P)) % P != 0:
+            return a, b
+
+sieveLimit = 4096
+primeSearchWindow = 4096
+parallelPrimeBits = 1024
+millerRabinRounds = 40
+# rounds giving error below 2^-80 for random odd candidates of at least the
+# given bit length (Handbook of Applied Cryptography, table 4.4)
+randomCandidateRounds = ((1300, 2), (850, 3), (650, 4), (550, 5), (450, 6), (400, 7), (350, 8),
+                         (300, 9), (250, 12), (200, 15), (150, 18), (100, 27))
+
+def sieveSmallPrimes(limit):
+    isPrime = np.ones(limit + 1, dtype=bool)
+    isPrime[:2] = False
+    for n in range(2, int(limit ** 0.5) + 1):
+        if isPrime[n]:
+            isPrime[n * n::n] = False
+    return np.flatnonzero(isPrime).tolist()
+
+smallPrimes = sieveSmallPrimes(sieveLimit)
+
+def isProbablePrime(n, rounds=millerRabinRounds):
+    if n < 2:
+        return False
+    for q in smallPrimes[:16]:
+        if n % q == 0:
+            return n == q
+    
+    d = n - 1
+    s = 0
+    while d % 2 == 0:
+        d //= 2
+        s += 1
+    
+    for _ in range(rounds):
+        x = pow(random.randint(2, n - 2), d, n)
+        if x == 1 or x == n - 1:
+            continue
+        for _ in range(s - 1):
+            x = pow(x, 2, n)
+            if x == n - 1:
+                break
+        else:
+            return False
+    return True
+
+def sieveWindow(start, length):
+    # bitmap over the odd numbers start, start + 2, ...; a candidate survives
+    # if no small prime divides it
+    survivors = np.ones(length, dtype=bool)
+    for q in smallPrimes[1:]:
+        # first i with start + 2i == 0 (mod q); (q + 1) / 2 is the inverse of 2
+        first = (-start * ((q + 1) // 2)) % q
+        if start + 2 * first == q:
+            first += q
+        survivors[first::q] = False
+    return np.flatnonzero(survivors).tolist()
+
+def roundsForRandomCandidate(bits):
+    for minimumBits, rounds in randomCandidateRounds:
+        if bits >= minimumBits:
+            return rounds
+    return millerRabinRounds
+
+def searchPrimeWindow(start, length, rounds=None):
+    if rounds is None:
+        rounds = roundsForRandomCandidate(start.bit_length())
+    for i in sieveWindow(start, length):
+        if isProbablePrime(start + 2 * i, rounds):
+            return start + 2 * i
+    return None
+
+def randomWindowStart(lower, upper, length):
+    start = random.randint(lower, max(lower, upper - 2 * length)) | 1
+    return start
+
+def generatePrime(bits, workers=None, lower=None, upper=None):
+    # random prime in [lower, upper), by default a full bits-bit prime
+    lower = 2 ** (bits - 1) if lower is None else lower
+    upper = 2 ** bits if upper is None else upper
+    length = min(primeSearchWindow, max(1, (upper - lower) // 2))
+    
+    if workers is None:
+        workers = os.cpu_count() if bits >= parallelPrimeBits else 1
+    
+    if workers <= 1:
+        while True:
+            prime = searchPrimeWindow(randomWindowStart(lower, upper, length), length)
+            if prime is not None and lower <= prime < upper:
+                return prime
+    
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        while True:
+            starts = [randomWindowStart(lower, upper, length) for _ in range(workers)]
+            for prime in executor.map(searchPrimeWindow, starts, [length] * workers):
+                if prime is not None and lower <= prime < upper:
+                    return prime
+
 def generateEcdhParameters(key_size=128):
     
     print(f"Generating ECDH parameters for {key_size}-bit security:")
@@ -85,17 +268,11 @@ def generateEcdhParameters(key_size=128):
     lower_bound = 2**(key_size - 1)
     upper_bound = 2**key_size - 1
     
-    P = sympy.randprime(lower_bound, upper_bound)
+    P = generatePrime(key_size, lower=lower_bound, upper=upper_bound)
 
     # print("  P = ",P)
     
-    while True:
-        a = random.randint(0, P-1)
-        b = random.randint(0, P-1)
-        discriminant = (4 * pow(a, 3, P) + 27 * pow(b, 2, P)) % P
-        
-        if discriminant != 0:
-            break
+    a, b = findCurveCoefficients(P)
 
     # print("  a = ",a)
     # print("  b = ",b)
@@ -116,7 +293,177 @@ def generateEcdhParameters(key_size=128):
     
     return P, a, b, G
 
+namedCurves = {
+    "P-256": {
+        "p": 0xffffffff00000001000000000000000000000000ffffffffffffffffffffffff,
+        "a": 0xffffffff00000001000000000000000000000000fffffffffffffffffffffffc,
+        "b": 0x5ac635d8aa3a93e7b3ebbd55769886bc651d06b0cc53b0f63bce3c3e27d2604b,
+        "G": (0x6b17d1f2e12c4247f8bce6e563a440f277037d812deb33a0f4a13945d898c296,
+              0x4fe342e2fe1a7f9b8ee7eb4a7c0f9e162bce33576b315ececbb6406837bf51f5),
+        "n": 0xffffffff00000000ffffffffffffffffbce6faada7179e84f3b9cac2fc632551,
+        "h": 1,
+    },
+    "P-384": {
+        "p": 0xfffffffffffffffffffffffffffffffffffffffffffffffffffffffffffffffeffffffff0000000000000000ffffffff,
+        "a": 0xfffffffffffffffffffffffffffffffffffffffffffffffffffffffffffffffeffffffff0000000000000000fffffffc,
+        "b": 0xb3312fa7e23ee7e4988e056be3f82d19181d9c6efe8141120314088f5013875ac656398d8a2ed19d2a85c8edd3ec2aef,
+        "G": (0xaa87ca22be8b05378eb1c71ef320ad746e1d3b628ba79b9859f741e082542a385502f25dbf55296c3a545e3872760ab7,
+              0x3617de4a96262c6f5d9e98bf9292dc29f8f41dbd289a147ce9da3113b5f0b8c00a60b1ce1d7e819d7a431d7c90ea0e5f),
+        "n": 0xffffffffffffffffffffffffffffffffffffffffffffffffc7634d81f4372ddf581a0db248b0a77aecec196accc52973,
+        "h": 1,
+    },
+    "secp256k1": {
+        "p": 0xfffffffffffffffffffffffffffffffffffffffffffffffffffffffefffffc2f,
+        "a": 0,
+        "b": 7,
+        "G": (0x79be667ef9dcbbac55a06295ce870b07029bfcdb2dce28d959f2815b16f81798,
+              0x483ada7726a3c4655da4fbfc0e1108a8fd17b448a68554199c47d08ffb10d4b8),
+        "n": 0xfffffffffffffffffffffffffffffffebaaedce6af48a03bbfd25e8cd0364141,
+        "h": 1,
+        # lambda * (x, y) = (beta * x, y), with a reduced basis of the lattice
+        # {(x, y) : x + y * lambda = 0 mod n} for splitting scalars
+        "endomorphism": {
+            "lambda": 0x5363ad4cc05c30e0a5261c028812645a122e22ea20816678df02967c1b23bd72,
+            "beta": 0x7ae96a2b657c07106e64479eac3434e99cf0497512f58995c1396c28719501ee,
+            "basis": ((0x3086d221a7d46bcde86c90e49284eb15, -0xe4437ed6010e88286f547fa90abfe4c3),
+                      (0x114ca50f7a8e2f3f657c1108d9d44cfd8, 0x3086d221a7d46bcde86c90e49284eb15)),
+        },
+    },
+}
+
+parameterCacheDirectory = os.environ.get("ECDH_CACHE_DIR", os.path.join(os.path.expanduser("~"), ".cache", "ecdh_2005104"))
+
+def customCurveName(P, a, b, G):
+    digest = hashlib.sha256(f"{P} {a} {b} {G[0]} {G[1]}".encode()).hexdigest()[:16]
+    return f"custom-{P.bit_length()}-{digest}"
 
+def curveParametersPath(name, cacheDirectory=None):
+    return os.path.join(cacheDirectory or parameterCacheDirectory, f"{name}.json")
+
+def saveCurveParameters(P, a, b, G, cacheDirectory=None):
+    name = customCurveName(P, a, b, G)
+    path = curveParametersPath(name, cacheDirectory)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    
+    temporaryPath = f"{path}.{os.getpid()}.tmp"
+    with open(temporaryPath, "w") as curveFile:
+        json.dump({"name": name, "p": P, "a": a, "b": b, "G": list(G)}, curveFile)
+    os.replace(temporaryPath, path)
+    
+    return name
+
+def loadCurveParameters(path):
+    with open(path) as curveFile:
+        stored = json.load(curveFile)
+    
+    P, a, b, G = stored["p"], stored["a"], stored["b"], tuple(stored["G"])
+    if customCurveName(P, a, b, G) != stored["name"] or curveCoefficientB(G, a, P) != b % P:
+        raise ValueError(f"Corrupt curve parameter file: {path}")
+    return P, a, b, G
+
+def getCurve(name, cacheDirectory=None):
+    # returns (P, a, b, G) like generateEcdhParameters
+    if name in namedCurves:
+        curve = namedCurves[name]
+        return curve["p"], curve["a"], curve["b"], curve["G"]
+    
+    if name.startswith("custom-"):
+        try:
+            return loadCurveParameters(curveParametersPath(name, cacheDirectory))
+        except OSError:
+            pass
+    raise ValueError(f"Unknown curve: {name}")
+
+def getCurveOrder(name):
+    # (n, h) for named curves; generated curves have unknown order
+    if name in namedCurves:
+        return namedCurves[name]["n"], namedCurves[name]["h"]
+    return None
+
+def findCurveOrder(p, a, b):
+    # n of the registered curve with these coefficients, None for a generated one
+    for curve in namedCurves.values():
+        if curve["p"] == p and curve["a"] == a % p and curve["b"] == b % p:
+            return curve["n"]
+    return None
+
+def loadOrGenerateEcdhParameters(key_size=128, cacheDirectory=None):
+    # reuses a previously generated curve of this size so the slow prime and
+    # point search happens once per machine instead of once per handshake
+    directory = cacheDirectory or parameterCacheDirectory
+    prefix = f"custom-{key_size}-"
+    try:
+        names = sorted(entry for entry in os.listdir(directory) if entry.startswith(prefix) and entry.endswith(".json"))
+    except OSError:
+        names = []
+    
+    for entry in names:
+        try:
+            return entry[:-len(".json")], loadCurveParameters(os.path.join(directory, entry))
+        except (OSError, ValueError, KeyError):
+            continue
+    
+    P, a, b, G = generateEcdhParameters(key_size)
+    try:
+        name = saveCurveParameters(P, a, b, G, directory)
+    except OSError:
+        name = customCurveName(P, a, b, G)
+    return name, (P, a, b, G)
+
+
+
+
+def coordinateSize(p):
+    return (p.bit_length() + 7) // 8
+
+def encodePoint(point, p, compressed=True):
+    # SEC1 encoding: 0x00 for infinity, 0x02/0x03 || x (y parity in the
+    # prefix) when compressed, 0x04 || x || y otherwise
+    if point is None:
+        return b"\x00"
+    
+    x, y = point
+    size = coordinateSize(p)
+    if compressed:
+        return bytes((2 + (y & 1),)) + x.to_bytes(size, "big")
+    return b"\x04" + x.to_bytes(size, "big") + y.to_bytes(size, "big")
+
+def decodePoint(data, a, b, p, allowInfinity=True):
+    data = bytes(data)
+    size = coordinateSize(p)
+    
+    if data == b"\x00":
+        if not allowInfinity:
+            raise ValueError("Point at infinity is not a valid public key")
+        return None
+    
+    if len(data) == 1 + 2 * size and data[0] == 4:
+        x = int.from_bytes(data[1:1 + size], "big")
+        y = int.from_bytes(data[1 + size:], "big")
+        if x >= p or y >= p or (y * y - x * x * x - a * x - b) % p != 0:
+            raise ValueError("Point is not on the curve")
+        return (x, y)
+    
+    if len(data) != 1 + size or data[0] not in (2, 3):
+        raise ValueError("Invalid point encoding")
+    
+    x = int.from_bytes(data[1:], "big")
+    if x >= p:
+        raise ValueError("Point is not on the curve")
+    
+    right_side = (pow(x, 3, p) + (a * x) % p + b) % p
+    if right_side == 0:
+        y = 0
+    else:
+        y = tonelliShanks(right_side, p)
+        if y is None:
+            raise ValueError("Point is not on the curve")
+    
+    if y & 1 != data[0] & 1:
+        if y == 0:
+            raise ValueError("Invalid point encoding")
+        y = p - y
+    return (x, y)
 
 def pointAddition(P1, P2, a, p):
     if P1 is None:
@@ -134,16 +481,20 @@ def pointAddition(P1, P2, a, p):
         if y1 == 0:
             return None
         
+        if operationHook is not None:
+            operationHook("double")
         numerator = (3 * pow(x1, 2, p) + a) % p
         denominator = (2 * y1) % p
         
-        invDenominator = pow(denominator, p - 2, p)
+        invDenominator = fieldInverse(denominator, p)
         slope = (numerator * invDenominator) % p
     else:
+        if operationHook is not None:
+            operationHook("add")
         numerator = (y2 - y1) % p
         denominator = (x2 - x1) % p
         
-        invDenominator = pow(denominator, p - 2, p)
+        invDenominator = fieldInverse(denominator, p)
         slope = (numerator * invDenominator) % p
     
     x3 = (pow(slope, 2, p) - x1 - x2) % p
@@ -172,11 +523,423 @@ def scalarMultiplication(k, point, a, p):
     
     return result
 
-def generatePrivateKey(key_size, p):
-    return random.randint(1, p-1)
+def toJacobian(point):
+    if point is None:
+        return None
+    x, y = point
+    return (x, y, 1)
+
+def fromJacobian(point, p):
+    if point is None:
+        return None
+    
+    X, Y, Z = point
+    invZ = fieldInverse(Z, p)
+    invZ2 = (invZ * invZ) % p
+    
+    return ((X * invZ2) % p, (Y * invZ2 * invZ) % p)
+
+def jacobianDouble(point, a, p):
+    if point is None:
+        return None
+    
+    X, Y, Z = point
+    if Y == 0:
+        return None
+    
+    if operationHook is not None:
+        operationHook("double")
+    YY = (Y * Y) % p
+    S = (4 * X * YY) % p
+    ZZ = (Z * Z) % p
+    M = (3 * X * X + a * ZZ * ZZ) % p
+    
+    X3 = (M * M - 2 * S) % p
+    Y3 = (M * (S - X3) - 8 * YY * YY) % p
+    Z3 = (2 * Y * Z) % p
+    
+    return (X3, Y3, Z3)
+
+def jacobianAddMixed(P1, P2, a, p):
+    # P1 is Jacobian, P2 is affine (Z = 1), which saves the Z2 products
+    if P2 is None:
+        return P1
+    if P1 is None:
+        return toJacobian(P2)
+    
+    X1, Y1, Z1 = P1
+    x2, y2 = P2
+    
+    Z1Z1 = (Z1 * Z1) % p
+    U2 = (x2 * Z1Z1) % p
+    S2 = (y2 * Z1 * Z1Z1) % p
+    H = (U2 - X1) % p
+    r = (S2 - Y1) % p
+    
+    if H == 0:
+        if r == 0:
+            return jacobianDouble(P1, a, p)
+        return None
+    
+    if operationHook is not None:
+        operationHook("add")
+    HH = (H * H) % p
+    HHH = (H * HH) % p
+    V = (X1 * HH) % p
+    
+    X3 = (r * r - HHH - 2 * V) % p
+    Y3 = (r * (V - X3) - Y1 * HHH) % p
+    Z3 = (Z1 * H) % p
+    
+    return (X3, Y3, Z3)
+
+def scalarMultiplicationJacobian(k, point, a, p):
+    
+    if k == 0 or point is None:
+        return None
+    
+    if k < 0:
+        x, y = point
+        point = (x, (-y) % p)
+        k = -k
+    
+    # left-to-right double-and-add; the only inversion is the final
+    # conversion back to affine coordinates
+    result = None
+    for bit in bin(k)[2:]:
+        result = jacobianDouble(result, a, p)
+        if bit == "1":
+            result = jacobianAddMixed(result, point, a, p)
+    
+    return fromJacobian(result, p)
+
+defaultWindowWidth = 4
+oddMultiplesCacheSize = 128
+
+def batchInverse(values, p):
+    # Montgomery's trick: one modular inversion plus 3(n - 1) multiplications
+    if not values:
+        return []
+    
+    prefix = [values[0] % p]
+    for value in values[1:]:
+        prefix.append((prefix[-1] * value) % p)
+    
+    inverse = fieldInverse(prefix[-1], p)
+    inverses = [0] * len(values)
+    for i in range(len(values) - 1, 0, -1):
+        inverses[i] = (inverse * prefix[i - 1]) % p
+        inverse = (inverse * values[i]) % p
+    inverses[0] = inverse
+    
+    return inverses
+
+def batchFromJacobian(points, p):
+    finite = [point for point in points if point is not None]
+    inverses = iter(batchInverse([Z for _, _, Z in finite], p))
+    
+    affinePoints = []
+    for point in points:
+        if point is None:
+            affinePoints.append(None)
+            continue
+        X, Y, _ = point
+        invZ = next(inverses)
+        invZ2 = (invZ * invZ) % p
+        affinePoints.append(((X * invZ2) % p, (Y * invZ2 * invZ) % p))
+    
+    return affinePoints
+
+def negatePoint(point, p):
+    if point is None:
+        return None
+    x, y = point
+    return (x, (-y) % p)
+
+def computeWnaf(k, w):
+    # width-w NAF, least significant digit first; every non-zero digit is odd
+    # and below 2^(w-1) in magnitude, and any w consecutive digits hold at
+    # most one non-zero
+    digits = []
+    while k > 0:
+        if k & 1:
+            digit = k & ((1 << w) - 1)
+            if digit >= 1 << (w - 1):
+                digit -= 1 << w
+            k -= digit
+        else:
+            digit = 0
+        digits.append(digit)
+        k >>= 1
+    return digits
+
+@lru_cache(maxsize=oddMultiplesCacheSize)
+def precomputeOddMultiples(point, a, p, w=defaultWindowWidth):
+    # [P, 3P, 5P, ..., (2^(w-1) - 1)P] in affine form for mixed additions
+    doubled = fromJacobian(jacobianDouble(toJacobian(point), a, p), p)
+    
+    multiples = [toJacobian(point)]
+    for _ in range((1 << (w - 2)) - 1):
+        multiples.append(jacobianAddMixed(multiples[-1], doubled, a, p))
+    
+    return tuple(batchFromJacobian(multiples, p))
+
+def scalarMultiplicationWnaf(k, point, a, p, w=defaultWindowWidth):
+    
+    if k == 0 or point is None:
+        return None
+    
+    if k < 0:
+        point = negatePoint(point, p)
+        k = -k
+    
+    oddMultiples = precomputeOddMultiples(point, a, p, w)
+    
+    result = None
+    for digit in reversed(computeWnaf(k, w)):
+        result = jacobianDouble(result, a, p)
+        if digit > 0:
+            result = jacobianAddMixed(result, oddMultiples[digit >> 1], a, p)
+        elif digit < 0:
+            result = jacobianAddMixed(result, negatePoint(oddMultiples[(-digit) >> 1], p), a, p)
+    
+    return fromJacobian(result, p)
+
+def countGroupOperations(k, w=None):
+    # (doubles, additions) of the main loop; w=None is the binary method
+    k = abs(k)
+    if w is None:
+        return max(k.bit_length() - 1, 0), max(bin(k).count("1") - 1, 0)
+    
+    digits = computeWnaf(k, w)
+    return max(len(digits) - 1, 0), max(sum(1 for digit in digits if digit) - 1, 0)
+
+@lru_cache(maxsize=None)
+def getGlvParameters(a, b, p):
+    # (n, lambda, beta, basis) for a named curve with a known endomorphism,
+    # after checking the constants actually belong together; None otherwise.
+    # b has to match as well: any y^2 = x^3 + b' over the same field has the
+    # same endomorphism, but a different group order and lambda
+    for curve in namedCurves.values():
+        if (curve["p"] != p or curve["a"] != a % p or curve["b"] != b % p
+                or "endomorphism" not in curve):
+            continue
+        
+        n, G = curve["n"], curve["G"]
+        endomorphism = curve["endomorphism"]
+        lam, beta = endomorphism["lambda"], endomorphism["beta"]
+        (a1, b1), (a2, b2) = endomorphism["basis"]
+        
+        if lam == 1 or pow(lam, 3, n) != 1 or beta == 1 or pow(beta, 3, p) != 1:
+            return None
+        if (a1 + b1 * lam) % n or (a2 + b2 * lam) % n or abs(a1 * b2 - a2 * b1) != n:
+            return None
+        if scalarMultiplicationWnaf(lam, G, curve["a"], p) != ((beta * G[0]) % p, G[1]):
+            return None
+        return n, lam, beta, endomorphism["basis"]
+    return None
+
+def decomposeScalar(k, n, basis):
+    # k = k1 + k2 * lambda (mod n) with |k1|, |k2| around sqrt(n), by rounding
+    # (k, 0) to the nearest lattice vector
+    (a1, b1), (a2, b2) = basis
+    c1 = (2 * b2 * k + n) // (2 * n)
+    c2 = (-2 * b1 * k + n) // (2 * n)
+    return k - c1 * a1 - c2 * a2, -c1 * b1 - c2 * b2
+
+def applyEndomorphism(point, beta, p):
+    if point is None:
+        return None
+    x, y = point
+    return ((beta * x) % p, y)
+
+def scalarMultiplicationGlv(k, point, a, p, w=defaultWindowWidth):
+    # k*P as k1*P + k2*lambda(P) with two half-length scalars sharing one
+    # chain of doublings; curves without known endomorphism use wNAF
+    if point is None:
+        return None
+    glv = getGlvParameters(a, curveCoefficientB(point, a, p), p)
+    if glv is None:
+        return scalarMultiplicationWnaf(k, point, a, p, w)
+    
+    n, _, beta, basis = glv
+    k %= n
+    if k == 0:
+        return None
+    
+    oddMultiples = precomputeOddMultiples(point, a, p, w)
+    components = []
+    for scalar, multiples in zip(decomposeScalar(k, n, basis),
+                                 (oddMultiples, tuple(applyEndomorphism(multiple, beta, p) for multiple in oddMultiples))):
+        if scalar < 0:
+            scalar = -scalar
+            multiples = tuple(negatePoint(multiple, p) for multiple in multiples)
+        components.append((computeWnaf(scalar, w), multiples))
+    
+    result = None
+    for i in range(max(len(digits) for digits, _ in components) - 1, -1, -1):
+        result = jacobianDouble(result, a, p)
+        for digits, multiples in components:
+            digit = digits[i] if i < len(digits) else 0
+            if digit > 0:
+                result = jacobianAddMixed(result, multiples[digit >> 1], a, p)
+            elif digit < 0:
+                result = jacobianAddMixed(result, negatePoint(multiples[(-digit) >> 1], p), a, p)
+    
+    return fromJacobian(result, p)
+
+fixedBaseWindowWidth = 4
+fixedBaseCacheSize = 16
+fixedBaseCacheDirectory = os.environ.get("ECDH_CACHE_DIR")
+# building a table costs ~15 scalar multiplications, so it is only built once
+# a base point is used again (or can be persisted to disk)
+fixedBaseBuildThreshold = 2
+fixedBaseRequests = OrderedDict()
+
+def curveCoefficientB(point, a, p):
+    x, y = point
+    return (y * y - x * x * x - a * x) % p
+
+def buildFixedBaseTable(G, a, p, w=fixedBaseWindowWidth):
+    # row i holds j * 2^(w*i) * G for j = 1 .. 2^w - 1, so k*G is the sum of
+    # one entry per w-bit window of k and needs no doublings at all
+    windows = -(-p.bit_length() // w)
+    rows = []
+    base = toJacobian(G)
+    
+    for _ in range(windows):
+        baseAffine = fromJacobian(base, p)
+        row = [base]
+        for _ in range((1 << w) - 2):
+            row.append(jacobianAddMixed(row[-1], baseAffine, a, p))
+        rows.append(row)
+        
+        for _ in range(w):
+            base = jacobianDouble(base, a, p)
+    
+    flat = batchFromJacobian([point for row in rows for point in row], p)
+    size = (1 << w) - 1
+    return tuple(tuple(flat[i:i + size]) for i in range(0, len(flat), size))
+
+def fixedBaseCachePath(G, a, p, w, cacheDirectory):
+    b = curveCoefficientB(G, a, p)
+    digest = hashlib.sha256(f"{p} {a} {b} {G[0]} {G[1]} {w}".encode()).hexdigest()[:32]
+    return os.path.join(cacheDirectory, f"fixed_base_{digest}.json")
+
+def loadFixedBaseTable(path, G, a, p, w):
+    try:
+        with open(path) as tableFile:
+            stored = json.load(tableFile)
+    except (OSError, ValueError):
+        return None
+    
+    if stored.get("params") != [p, a, G[0], G[1], w]:
+        return None
+    try:
+        table = tuple(tuple(None if point is None else tuple(point) for point in row) for row in stored["table"])
+        return table if isValidFixedBaseTable(table, G, a, p, w) else None
+    except (KeyError, TypeError, ValueError):
+        return None
+
+def isAffineSum(P1, P2, P3, a, p):
+    # P1 + P2 == P3, with the chord or tangent slope kept as a fraction so no
+    # inversion is needed
+    (x1, y1), (x2, y2), (x3, y3) = P1, P2, P3
+    if x1 == x2:
+        if y1 != y2 or y1 == 0:
+            return False
+        numerator, denominator = 3 * x1 * x1 + a, 2 * y1
+    else:
+        numerator, denominator = y2 - y1, x2 - x1
+    
+    return ((numerator * numerator - (x1 + x2 + x3) * denominator * denominator) % p == 0
+            and ((y3 + y1) * denominator - numerator * (x1 - x3)) % p == 0)
+
+def isValidFixedBaseTable(table, G, a, p, w):
+    # every entry must be on the curve and in its slot: row i holds
+    # j * 2^(w*i) * G, so each entry is the previous one plus the row's first,
+    # and the next row starts at (2^w - 1) * base + base
+    windows = -(-p.bit_length() // w)
+    size = (1 << w) - 1
+    if len(table) != windows or any(len(row) != size for row in table) or table[0][0] != tuple(G):
+        return False
+    
+    b = curveCoefficientB(G, a, p)
+    for i, row in enumerate(table):
+        for point in row:
+            if point is None:
+                return False
+            x, y = point
+            if not (0 <= x < p and 0 <= y < p) or (y * y - x * x * x - a * x - b) % p:
+                return False
+        
+        for j in range(1, size):
+            if not isAffineSum(row[j - 1], row[0], row[j], a, p):
+                return False
+        if i + 1 < windows and not isAffineSum(row[-1], row[0], table[i + 1][0], a, p):
+            return False
+    
+    return True
+
+def saveFixedBaseTable(path, table, G, a, p, w):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    temporaryPath = f"{path}.{os.getpid()}.tmp"
+    with open(temporaryPath, "w") as tableFile:
+        json.dump({"params": [p, a, G[0], G[1], w], "table": table}, tableFile, default=int)
+    os.replace(temporaryPath, path)
+
+def shouldUseFixedBase(G, a, p, w):
+    key = (G, a, p, w)
+    count = fixedBaseRequests.pop(key, 0) + 1
+    fixedBaseRequests[key] = count
+    if len(fixedBaseRequests) > 4 * fixedBaseCacheSize:
+        fixedBaseRequests.popitem(last=False)
+    
+    return count >= fixedBaseBuildThreshold or fixedBaseCacheDirectory is not None
+
+@lru_cache(maxsize=fixedBaseCacheSize)
+def getFixedBaseTable(G, a, p, w=fixedBaseWindowWidth, cacheDirectory=None):
+    cacheDirectory = cacheDirectory or fixedBaseCacheDirectory
+    if cacheDirectory is None:
+        return buildFixedBaseTable(G, a, p, w)
+    
+    path = fixedBaseCachePath(G, a, p, w, cacheDirectory)
+    table = loadFixedBaseTable(path, G, a, p, w)
+    if table is None:
+        table = buildFixedBaseTable(G, a, p, w)
+        try:
+            saveFixedBaseTable(path, table, G, a, p, w)
+        except OSError:
+            pass
+    return table
+
+def scalarMultiplicationFixedBase(k, G, a, p, w=fixedBaseWindowWidth):
+    
+    if k <= 0 or G is None or k.bit_length() > -(-p.bit_length() // w) * w:
+        return scalarMultiplicationGlv(k, G, a, p)
+    
+    if not shouldUseFixedBase(G, a, p, w):
+        return scalarMultiplicationGlv(k, G, a, p)
+    
+    table = getFixedBaseTable(G, a, p, w)
+    mask = (1 << w) - 1
+    
+    result = None
+    for row in table:
+        digit = k & mask
+        if digit:
+            result = jacobianAddMixed(result, row[digit - 1], a, p)
+        k >>= w
+    
+    return fromJacobian(result, p)
+
+def generatePrivateKey(key_size, p, order=None):
+    # uniform in [1, n) from the OS CSPRNG; p only stands in for n on
+    # generated curves, whose order is unknown
+    return secrets.randbelow((order or p) - 1) + 1
 
 def generatePublicKey(privateKey, G, a, p):
-    return scalarMultiplication(privateKey, G, a, p)
+    return lowerPoint(scalarMultiplicationFixedBase(privateKey, liftPoint(G), fieldElement(a), fieldElement(p)))
 
 def measureKeyGenerationTime(G, a, p, key_size, num_trials=5):
     totalTime = 0
@@ -190,8 +953,173 @@ def measureKeyGenerationTime(G, a, p, key_size, num_trials=5):
     
     return totalTime / num_trials
 
+def batchPointAddition(points, addends, a, p):
+    # affine additions points[i] + addends[i] sharing a single inversion
+    results = list(points)
+    pending = []
+    numerators = []
+    denominators = []
+    
+    for i, (P1, P2) in enumerate(zip(points, addends)):
+        if P2 is None:
+            continue
+        if P1 is None:
+            results[i] = P2
+            continue
+        
+        x1, y1 = P1
+        x2, y2 = P2
+        if x1 == x2:
+            if y1 != y2 or y1 == 0:
+                results[i] = None
+                continue
+            if operationHook is not None:
+                operationHook("double")
+            numerators.append((3 * x1 * x1 + a) % p)
+            denominators.append((2 * y1) % p)
+        else:
+            if operationHook is not None:
+                operationHook("add")
+            numerators.append((y2 - y1) % p)
+            denominators.append((x2 - x1) % p)
+        pending.append(i)
+    
+    for i, numerator, inverse in zip(pending, numerators, batchInverse(denominators, p)):
+        (x1, y1), (x2, _) = points[i], addends[i]
+        slope = (numerator * inverse) % p
+        x3 = (slope * slope - x1 - x2) % p
+        results[i] = (x3, (slope * (x1 - x3) - y1) % p)
+    
+    return results
+
+def generateKeypairs(n, curve, w=fixedBaseWindowWidth):
+    # n fixed-base multiplications advanced window by window in lockstep, so
+    # every window costs one shared inversion for all n keys
+    P, a, b, G = curve
+    keySize = P.bit_length()
+    order = findCurveOrder(P, a, b)
+    privateKeys = [generatePrivateKey(keySize, P, order) for _ in range(n)]
+    P, a, G = fieldElement(P), fieldElement(a), liftPoint(G)
+    table = getFixedBaseTable(G, a, P, w)
+    mask = (1 << w) - 1
+    
+    publicKeys = [None] * n
+    for i, row in enumerate(table):
+        addends = []
+        for privateKey in privateKeys:
+            digit = (privateKey >> (w * i)) & mask
+            addends.append(row[digit - 1] if digit else None)
+        publicKeys = batchPointAddition(publicKeys, addends, a, P)
+    
+    return list(zip(privateKeys, map(lowerPoint, publicKeys)))
+
+class KeypairPool:
+    # keeps ready ephemeral key pairs for one curve, refilled in batches by a
+    # background thread whenever it drops below lowWater
+    def __init__(self, curve, size=256, batchSize=64, lowWater=None):
+        self.curve = curve
+        self.size = size
+        self.batchSize = batchSize
+        self.lowWater = size // 2 if lowWater is None else lowWater
+        self.keypairs = deque()
+        self.condition = threading.Condition()
+        self.closed = False
+        self.thread = threading.Thread(target=self.refill, daemon=True)
+        self.thread.start()
+    
+    def refill(self):
+        while True:
+            with self.condition:
+                while not self.closed and len(self.keypairs) > self.lowWater:
+                    self.condition.wait()
+            
+            # top the pool back up to its full size, one batch at a time
+            while True:
+                with self.condition:
+                    if self.closed:
+                        return
+                    count = min(self.batchSize, self.size - len(self.keypairs))
+                if count <= 0:
+                    break
+                
+                keypairs = generateKeypairs(count, self.curve)
+                with self.condition:
+                    self.keypairs.extend(keypairs)
+    
+    def get(self):
+        with self.condition:
+            if self.keypairs:
+                keypair = self.keypairs.popleft()
+                if len(self.keypairs) <= self.lowWater:
+                    self.condition.notify_all()
+                return keypair
+        # pool drained faster than it refills: fall back to a direct key
+        return generateKeypairs(1, self.curve)[0]
+    
+    def close(self):
+        with self.condition:
+            self.closed = True
+            self.condition.notify_all()
+        self.thread.join()
+
+def measureBatchKeyGenerationTime(curve, batchSize=100):
+    startTime = time.time()
+    generateKeypairs(batchSize, curve)
+    return (time.time() - startTime) / batchSize
+
 def computeShareKey(privateKey, other_public_key, a, p):
-    return scalarMultiplication(privateKey, other_public_key, a, p)
+    return lowerPoint(scalarMultiplicationGlv(privateKey, liftPoint(other_public_key), fieldElement(a), fieldElement(p)))
+
+def xOnlyDouble(X, Z, a, b, p):
+    # Brier-Joye doubling on x = X/Z for y^2 = x^3 + ax + b
+    if operationHook is not None:
+        operationHook("double")
+    XX = (X * X) % p
+    ZZ = (Z * Z) % p
+    aZZ = (a * ZZ) % p
+    t = (XX - aZZ) % p
+    ZZZ = (Z * ZZ) % p
+    
+    X2 = (t * t - 8 * b * ((X * ZZZ) % p)) % p
+    Z2 = (4 * (Z * ((X * (XX + aZZ)) % p) + b * ((ZZZ * Z) % p))) % p
+    return X2, Z2
+
+def xOnlyDifferentialAdd(X1, Z1, X2, Z2, xD, a, b, p):
+    # x of P1 + P2 from x of P1, P2 and of their difference xD (affine)
+    if operationHook is not None:
+        operationHook("add")
+    T1 = (X1 * Z2) % p
+    T2 = (X2 * Z1) % p
+    Z1Z2 = (Z1 * Z2) % p
+    difference = (T1 - T2) % p
+    
+    Z3 = (difference * difference) % p
+    X3 = (2 * (T1 + T2) * ((X1 * X2 + a * Z1Z2) % p) + 4 * b * ((Z1Z2 * Z1Z2) % p) - xD * Z3) % p
+    return X3, Z3
+
+def computeSharedX(privateKey, otherPublicKey, a, p, b):
+    # Montgomery ladder on x-coordinates only: every bit costs exactly one
+    # differential addition and one doubling, whatever its value. b is taken
+    # from the agreed curve, never recovered from the peer's point, which
+    # could sit on a weaker curve
+    if privateKey <= 0 or otherPublicKey is None:
+        return None
+    
+    a, p = fieldElement(a), fieldElement(p)
+    xP = fieldElement(otherPublicKey[0])
+    b = fieldElement(b)
+    
+    R = [(1, 0), (xP, 1)]
+    for i in range(max(p.bit_length(), privateKey.bit_length()) - 1, -1, -1):
+        bit = (privateKey >> i) & 1
+        (X0, Z0), (X1, Z1) = R[bit ^ 1], R[bit]
+        R[bit ^ 1] = xOnlyDifferentialAdd(X0, Z0, X1, Z1, xP, a, b, p)
+        R[bit] = xOnlyDouble(X1, Z1, a, b, p)
+    
+    X, Z = R[0]
+    if Z == 0:
+        return None
+    return int((X * fieldInverse(Z, p)) % p)
 
 def measureSharedSecretComputationTime(privateKey, public_key, a, p, num_trials=5):
     totalTime = 0
@@ -205,7 +1133,8 @@ def measureSharedSecretComputationTime(privateKey, public_key, a, p, num_trials=
 
 def runEcdhPerformanceTest(key_size, num_trials=5):
     print(f"\nRunning ECDH performance test for {key_size}-bit key:")
-    P, a, b, G = generateEcdhParameters(key_size)
+    curveName, (P, a, b, G) = loadOrGenerateEcdhParameters(key_size)
+    print(f"  Curve: {curveName}")
     
     alicePrivateKey = generatePrivateKey(key_size, P)
     print(f"  Alice's private key: {alicePrivateKey}")
@@ -217,6 +1146,12 @@ def runEcdhPerformanceTest(key_size, num_trials=5):
     print(f"  Alice's public key: {alicePublicKey}")
     print(f"  Alice's public key generated in {aliceTime:.6f} seconds")
     
+    binaryDoubles, binaryAdds = countGroupOperations(alicePrivateKey)
+    wnafDoubles, wnafAdds = countGroupOperations(alicePrivateKey, defaultWindowWidth)
+    print(f"  Group operations (binary): {binaryDoubles} doubles, {binaryAdds} additions")
+    print(f"  Group operations (w={defaultWindowWidth} NAF): {wnafDoubles} doubles, {wnafAdds} additions"
+          f" + {(1 << (defaultWindowWidth - 2)) - 1} precomputed")
+    
     print("\nGenerating Bob's key pair:")
     bobPrivateKey = generatePrivateKey(key_size, P)
     print(f"  Bob's private key: {bobPrivateKey}")
@@ -248,6 +1183,11 @@ def runEcdhPerformanceTest(key_size, num_trials=5):
     print(f"  Shared secret (x-coordinate): {aliceSharedKey[0]}")
     print(f"  Shared secret computed in average {shared_secretTime:.6f} seconds")
     
+    startTime = time.time()
+    scalarMultiplicationJacobian(alicePrivateKey, liftPoint(bobPublicKey), fieldElement(a), fieldElement(P))
+    binaryTime = time.time() - startTime
+    print(f"  Same shared secret with binary double-and-add: {binaryTime:.6f} seconds")
+    
     print(f"\nMeasuring average times over {num_trials} trials:")
     
     alice_key_avgTime = measureKeyGenerationTime(G, a, P, key_size, num_trials)
@@ -258,6 +1198,8 @@ def runEcdhPerformanceTest(key_size, num_trials=5):
     )
     
     print(f"  Average time for Alice's key generation: {alice_key_avgTime:.6f} seconds")
+    print(f"  Average time per key in a batch of 100: "
+          f"{measureBatchKeyGenerationTime((P, a, b, G)):.6f} seconds")
     print(f"  Average time for Bob's key generation: {bob_key_avgTime:.6f} seconds")
     print(f"  Average time for shared secret computation: {shared_key_avgTime:.6f} seconds")
     
@@ -268,27 +1210,32 @@ def runEcdhPerformanceTest(key_size, num_trials=5):
     }
 
 
-def main():
-    random.seed(42)
-    
+def main(backends=None):
     key_sizes = [128, 192, 256]
     results = {}
     
-    for key_size in key_sizes:
-        results[key_size] = runEcdhPerformanceTest(key_size)
-    
-    print("\nPerformance Results (Average of 5 trials):")
-    print("=" * 60)
-    print(f"{' ':8} | {'Computation Time For':^45}")
-    print(f"{'k':^8} | {'':45}")
-    print(f"{'':8} | {'A':^15} | {'B':^15} | {'shared key R':^15}")
-    print("-" * 60)
+    # the same seed for every backend, so each one sees the same curves
+    defaultBackend = fieldBackend.name
+    for backend in backends or list(fieldBackends):
+        setFieldBackend(backend)
+        random.seed(42)
+        print(f"\nField backend: {backend}")
+        results[backend] = {key_size: runEcdhPerformanceTest(key_size) for key_size in key_sizes}
+    setFieldBackend(defaultBackend)
     
-    for key_size in key_sizes:
-        times = results[key_size]
-        print(f"{key_size:<8} | {times['A']:<15.6f} | {times['B']:<15.6f} | {times['shared_key']:<15.6f}")
-    
-    print("=" * 60)
+    for backend, backendResults in results.items():
+        print(f"\nPerformance Results (Average of 5 trials, {backend} field backend):")
+        print("=" * 60)
+        print(f"{' ':8} | {'Computation Time For':^45}")
+        print(f"{'k':^8} | {'':45}")
+        print(f"{'':8} | {'A':^15} | {'B':^15} | {'shared key R':^15}")
+        print("-" * 60)
+        
+        for key_size in key_sizes:
+            times = backendResults[key_size]
+            print(f"{key_size:<8} | {times['A']:<15.6f} | {times['B']:<15.6f} | {times['shared_key']:<15.6f}")
+        
+        print("=" * 60)
 
 
 if __name__ == "__main__":
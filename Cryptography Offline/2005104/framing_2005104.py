@@ -0,0 +1,258 @@
+import aes_2005104 as aes
+import asyncio
+import struct
+
+# every frame is type (1 byte), payload length (4 bytes), IV (16 bytes), then
+# the payload; the IV is all zeros for frames that are not encrypted
+headerStruct = struct.Struct(">BI16s")
+headerSize = headerStruct.size
+emptyIv = bytes(16)
+
+handshakeFrame = 1
+publicKeyFrame = 2
+messageFrame = 3
+# session resumption: the server sends an encrypted ticket after every
+# handshake (empty when it does not issue tickets), and a returning client
+# presents it with its nonce
+ticketFrame = 4
+resumeFrame = 5
+resumeAcceptedFrame = 6
+resumeRejectedFrame = 7
+
+maxPayloadSize = 1 << 26
+initialBufferSize = 1 << 16
+
+
+def checkPayloadLength(length, maxSize=maxPayloadSize):
+    if length > maxSize:
+        raise ValueError(f"Frame payload of {length} bytes exceeds the {maxSize}-byte limit")
+
+
+def encodeFrame(frameType, payload, iv=emptyIv):
+    checkPayloadLength(len(payload))
+    frame = bytearray(headerSize + len(payload))
+    headerStruct.pack_into(frame, 0, frameType, len(payload), iv)
+    frame[headerSize:] = payload
+    return frame
+
+
+def encodeMessageFrame(roundKeys, data, frameType=messageFrame):
+    # the IV field of the header doubles as the CBC IV, so the cipher text is
+    # written straight into the frame after it
+    padded = aes.applyPaddingBytes(data)
+    checkPayloadLength(len(padded))
+    iv = aes.generateInitializationVectorBytes()
+
+    frame = bytearray(headerSize + len(padded))
+    headerStruct.pack_into(frame, 0, frameType, len(padded), iv)
+    aes.cbcEncryptInto(aes.generateRoundKeyWords(roundKeys), padded, aes.blockStruct.unpack(iv), frame, headerSize)
+    return frame
+
+
+def decryptMessage(roundKeys, body, unpad=True):
+    # body is the IV followed by the payload, exactly as aes.decrypt expects
+    return aes.decrypt(roundKeys, body, unpad)
+
+
+def sendFrame(sock, frameType, payload, iv=emptyIv):
+    sock.sendall(encodeFrame(frameType, payload, iv))
+
+
+def sendMessage(sock, roundKeys, data, frameType=messageFrame):
+    frame = encodeMessageFrame(roundKeys, data, frameType)
+    sock.sendall(frame)
+    return frame
+
+
+class FrameReader:
+    # reads frames from a blocking socket into one reusable buffer; the body
+    # returned by readFrame is a view of that buffer and is only valid until
+    # the next call
+    def __init__(self, sock, bufferSize=initialBufferSize, maxSize=maxPayloadSize):
+        self.sock = sock
+        self.maxSize = maxSize
+        self.buffer = bytearray(max(bufferSize, headerSize))
+        self.view = memoryview(self.buffer)
+
+    def receiveInto(self, start, end):
+        while start < end:
+            received = self.sock.recv_into(self.view[start:end])
+            if not received:
+                raise ConnectionError("Connection closed in the middle of a frame")
+            start += received
+
+    def ensureCapacity(self, size):
+        if size <= len(self.buffer):
+            return
+        capacity = len(self.buffer)
+        while capacity < size:
+            capacity *= 2
+        buffer = bytearray(capacity)
+        buffer[:headerSize] = self.view[:headerSize]
+        self.buffer = buffer
+        self.view = memoryview(buffer)
+
+    def readFrame(self):
+        # returns (frameType, body) where body is the IV followed by the payload
+        self.receiveInto(0, headerSize)
+        frameType, length, _ = headerStruct.unpack_from(self.buffer)
+        checkPayloadLength(length, self.maxSize)
+
+        self.ensureCapacity(headerSize + length)
+        self.receiveInto(headerSize, headerSize + length)
+        return frameType, self.view[headerSize - 16:headerSize + length]
+
+
+class FrameProtocol(asyncio.BufferedProtocol):
+    # asyncio counterpart of FrameReader: the transport receives straight into
+    # one buffer per connection, first exactly a header and then exactly its
+    # payload, and stops reading once a whole frame is waiting. It also stands
+    # in for a StreamWriter, so writeFrame and writeMessage accept it
+    def __init__(self, connectionHandler, bufferSize=initialBufferSize, maxSize=maxPayloadSize):
+        self.connectionHandler = connectionHandler
+        self.maxSize = maxSize
+        self.bufferSize = max(bufferSize, headerSize)
+        self.buffer = bytearray(self.bufferSize)
+        self.view = memoryview(self.buffer)
+        self.filled = 0
+        self.needed = headerSize
+        self.headerParsed = False
+        self.frameReady = False
+        self.frameConsumed = False
+        self.error = None
+        self.transport = None
+        self.task = None
+        self.frameWaiter = None
+        self.drainWaiter = None
+        self.writingPaused = False
+        self.closed = None
+
+    def connection_made(self, transport):
+        self.transport = transport
+        loop = asyncio.get_running_loop()
+        self.closed = loop.create_future()
+        self.task = loop.create_task(self.connectionHandler(self))
+
+    def get_buffer(self, sizeHint):
+        return self.view[self.filled:self.needed]
+
+    def buffer_updated(self, nbytes):
+        self.filled += nbytes
+        if self.filled == headerSize and not self.headerParsed:
+            _, length, _ = headerStruct.unpack_from(self.buffer)
+            try:
+                checkPayloadLength(length, self.maxSize)
+            except ValueError as error:
+                self.transport.pause_reading()
+                self.fail(error)
+                return
+            self.ensureCapacity(headerSize + length)
+            self.needed = headerSize + length
+            self.headerParsed = True
+
+        if self.headerParsed and self.filled == self.needed:
+            self.frameReady = True
+            self.transport.pause_reading()
+            self.wake(self.frameWaiter)
+
+    def ensureCapacity(self, size):
+        if size <= len(self.buffer):
+            return
+        capacity = len(self.buffer)
+        while capacity < size:
+            capacity *= 2
+        buffer = bytearray(capacity)
+        buffer[:headerSize] = self.view[:headerSize]
+        self.buffer = buffer
+        self.view = memoryview(buffer)
+
+    def incompleteRead(self):
+        # a frame that is already complete still gets delivered, so what is
+        # missing is the next one
+        partial = b"" if self.frameReady else bytes(self.view[:self.filled])
+        return asyncio.IncompleteReadError(partial, self.needed)
+
+    def eof_received(self):
+        self.fail(self.incompleteRead())
+        return False
+
+    def connection_lost(self, error):
+        self.fail(error or self.incompleteRead())
+        self.wake(self.drainWaiter, ConnectionResetError("Connection lost"))
+        if not self.closed.done():
+            self.closed.set_result(None)
+
+    def pause_writing(self):
+        self.writingPaused = True
+
+    def resume_writing(self):
+        self.writingPaused = False
+        self.wake(self.drainWaiter)
+
+    def fail(self, error):
+        if self.error is None:
+            self.error = error
+        self.wake(self.frameWaiter)
+
+    def wake(self, waiter, error=None):
+        if waiter is None or waiter.done():
+            return
+        if error is None:
+            waiter.set_result(None)
+        else:
+            waiter.set_exception(error)
+
+    async def readFrame(self):
+        # returns (frameType, body) like FrameReader.readFrame; body is a view
+        # of the buffer and is only valid until the next call
+        if self.frameConsumed:
+            self.filled, self.needed = 0, headerSize
+            self.headerParsed = self.frameReady = self.frameConsumed = False
+            # a buffer grown for one large message is not kept for the
+            # rest of the session
+            if len(self.buffer) > self.bufferSize:
+                self.buffer = bytearray(self.bufferSize)
+                self.view = memoryview(self.buffer)
+            if not self.transport.is_closing():
+                self.transport.resume_reading()
+
+        while not self.frameReady:
+            if self.error is not None:
+                raise self.error
+            self.frameWaiter = asyncio.get_running_loop().create_future()
+            await self.frameWaiter
+
+        self.frameConsumed = True
+        frameType, _, _ = headerStruct.unpack_from(self.buffer)
+        return frameType, self.view[headerSize - 16:self.needed]
+
+    def write(self, data):
+        self.transport.write(data)
+
+    async def drain(self):
+        if self.closed.done():
+            raise ConnectionResetError("Connection lost")
+        if self.writingPaused:
+            self.drainWaiter = asyncio.get_running_loop().create_future()
+            await self.drainWaiter
+
+    def get_extra_info(self, name, default=None):
+        return self.transport.get_extra_info(name, default)
+
+    def close(self):
+        self.transport.close()
+
+    async def wait_closed(self):
+        await self.closed
+
+
+async def writeFrame(writer, frameType, payload, iv=emptyIv):
+    writer.write(encodeFrame(frameType, payload, iv))
+    await writer.drain()
+
+
+async def writeMessage(writer, roundKeys, data, frameType=messageFrame):
+    frame = encodeMessageFrame(roundKeys, data, frameType)
+    writer.write(frame)
+    await writer.drain()
+    return frame
@@ -0,0 +1,108 @@
+import aes_2005104 as aes
+import ecdh_2005104 as ecdh
+import hashlib
+import hmac
+import json
+import os
+import struct
+import time
+from collections import OrderedDict
+
+# a ticket is the server's own note of a session's master secret, sealed with
+# AES-GCM under a key only the server knows: issue time, master secret
+ticketStruct = struct.Struct(">Q32s")
+ticketAad = b"chat session ticket v1"
+ticketLifetime = 24 * 60 * 60
+nonceSize = 16
+
+
+def hmacSha256(key, data):
+    return hmac.new(key, data, hashlib.sha256).digest()
+
+
+def deriveMasterSecret(sharedKey, p):
+    return hmacSha256(sharedKey.to_bytes(ecdh.coordinateSize(p), "big"), b"master secret")
+
+
+def deriveResumedSecrets(masterSecret, clientNonce, serverNonce):
+    # (AES key bytes, master secret for the next ticket); both nonces are
+    # fresh, so every resumed session gets its own keys without any EC math
+    nonces = bytes(clientNonce) + bytes(serverNonce)
+    keyBytes = hmacSha256(masterSecret, b"session key" + nonces)[:16]
+    return keyBytes, hmacSha256(masterSecret, b"master secret" + nonces)
+
+
+def generateTicketKey():
+    return aes.ExpandedKey(os.urandom(16))
+
+
+def issueTicket(ticketKey, masterSecret, issued=None):
+    issued = int(time.time()) if issued is None else issued
+    return aes.encryptGCM(ticketKey, ticketStruct.pack(issued, masterSecret), ticketAad)
+
+
+def openTicket(ticketKey, ticket, lifetime=ticketLifetime, now=None):
+    # the master secret of a ticket this key issued, or None if the ticket is
+    # forged, corrupt or expired
+    try:
+        plainText = aes.decryptGCM(ticketKey, ticket, ticketAad)
+    except ValueError:
+        return None
+    if len(plainText) != ticketStruct.size:
+        return None
+
+    issued, masterSecret = ticketStruct.unpack(plainText)
+    now = time.time() if now is None else now
+    if issued > now or now - issued > lifetime:
+        return None
+    return masterSecret
+
+
+class RedeemedTickets:
+    # tickets that have already resumed a session; each is kept for a full
+    # lifetime after it is redeemed, by which time it has expired anyway, so
+    # a replayed ticket is refused and the set stays bounded
+    def __init__(self, lifetime=ticketLifetime):
+        self.lifetime = lifetime
+        self.expiries = OrderedDict()
+    
+    def redeem(self, ticket, now=None):
+        # True the first time a ticket is seen, False for a replay
+        now = time.time() if now is None else now
+        while self.expiries and next(iter(self.expiries.values())) < now:
+            self.expiries.popitem(last=False)
+        
+        digest = hashlib.sha256(bytes(ticket)).digest()
+        if digest in self.expiries:
+            return False
+        self.expiries[digest] = now + self.lifetime
+        return True
+
+
+def saveTicket(path, server, ticket, masterSecret):
+    # the master secret is as sensitive as a session key, so the file is
+    # only readable by its owner
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    temporaryPath = f"{path}.{os.getpid()}.tmp"
+    descriptor = os.open(temporaryPath, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+    with os.fdopen(descriptor, "w") as ticketFile:
+        json.dump({"server": server, "ticket": bytes(ticket).hex(), "masterSecret": masterSecret.hex()}, ticketFile)
+    os.replace(temporaryPath, path)
+
+
+def loadTicket(path, server):
+    try:
+        with open(path) as ticketFile:
+            stored = json.load(ticketFile)
+        if stored.get("server") != server:
+            return None
+        return bytes.fromhex(stored["ticket"]), bytes.fromhex(stored["masterSecret"])
+    except (OSError, ValueError, KeyError, TypeError):
+        return None
+
+
+def discardTicket(path):
+    try:
+        os.remove(path)
+    except OSError:
+        pass